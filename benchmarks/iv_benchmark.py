@@ -0,0 +1,91 @@
+# Accuracy / speed of the vectorized IV solver against py_vollib on recorded trades.
+#
+#   python -m benchmarks.iv_benchmark
+#   python -m benchmarks.iv_benchmark --underlying-csv aapl_trades.csv --repeat 50
+#
+# The recorded option trades (market_data/option.csv) carry no underlying price, pass a
+# Databento trades csv of the underlying with --underlying-csv to match them as-of, or a
+# constant with --underlying.
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from py_vollib.black_scholes.implied_volatility import implied_volatility as py_vollib_iv
+
+from market_data.pricing import implied_volatility, IV_OK, IV_STATUS_NAMES
+from market_data.tables import decode_option_ticker, RISK_FREE_RATE
+
+DEFAULT_OPTION_CSV = os.path.join(os.path.dirname(os.path.dirname(__file__)), "market_data", "option.csv")
+
+
+def load_rows(option_csv, underlying_csv, underlying, repeat):
+    df = pd.read_csv(option_csv, parse_dates=["ts_event"])
+    df = df[df["action"] == "T"].sort_values("ts_event")
+
+    if underlying_csv:
+        df_underlying = pd.read_csv(underlying_csv, parse_dates=["ts_event"]).sort_values("ts_event")
+        df = pd.merge_asof(df, df_underlying[["ts_event", "price"]], on="ts_event", direction="backward", suffixes=("", "_underlying"))
+    else:
+        df["price_underlying"] = underlying
+
+    _, _, expiration_date, strike_price, t = decode_option_ticker(df["symbol"].iloc[0])
+    years = (pd.Timestamp(expiration_date) - df["ts_event"]).dt.total_seconds() / (3600 * 24 * 365.25)
+
+    rows = {
+        "price": np.tile(df["price"].to_numpy(dtype=float), repeat),
+        "underlying": np.tile(df["price_underlying"].to_numpy(dtype=float), repeat),
+        "years": np.tile(years.to_numpy(), repeat),
+    }
+    return rows, strike_price, t.lower()
+
+
+def run_py_vollib(rows, strike_price, flag):
+    out = np.full(rows["price"].size, np.nan)
+    for i, (price, underlying, years) in enumerate(zip(rows["price"], rows["underlying"], rows["years"])):
+        try:
+            out[i] = py_vollib_iv(price, underlying, strike_price, years, RISK_FREE_RATE, flag)
+        except Exception:
+            pass
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--option-csv", default=DEFAULT_OPTION_CSV)
+    parser.add_argument("--underlying-csv", default=None)
+    parser.add_argument("--underlying", type=float, default=211.0)
+    parser.add_argument("--repeat", type=int, default=20, help="tile the recorded rows to get a busy-contract row count")
+    args = parser.parse_args()
+
+    rows, strike_price, flag = load_rows(args.option_csv, args.underlying_csv, args.underlying, args.repeat)
+    n = rows["price"].size
+
+    start = time.perf_counter()
+    reference = run_py_vollib(rows, strike_price, flag)
+    py_vollib_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    iv, status = implied_volatility(rows["price"], rows["underlying"], strike_price, rows["years"], RISK_FREE_RATE, flag)
+    vectorized_time = time.perf_counter() - start
+
+    both = (status == IV_OK) & np.isfinite(reference)
+    abs_err = np.abs(iv[both] - reference[both])
+
+    print(f"rows:                {n}")
+    print(f"py_vollib:           {py_vollib_time * 1000:.1f} ms")
+    print(f"vectorized:          {vectorized_time * 1000:.1f} ms ({py_vollib_time / vectorized_time:.0f}x)")
+    print(f"solved by both:      {both.sum()}")
+    print(f"only py_vollib:      {(np.isfinite(reference) & (status != IV_OK)).sum()}")
+    print(f"only vectorized:     {(~np.isfinite(reference) & (status == IV_OK)).sum()}")
+    if abs_err.size:
+        print(f"max abs error:       {abs_err.max():.2e}")
+        print(f"mean abs error:      {abs_err.mean():.2e}")
+    for code, count in zip(*np.unique(status, return_counts=True)):
+        print(f"status {IV_STATUS_NAMES[code]:<15} {count}")
+
+
+if __name__ == "__main__":
+    main()
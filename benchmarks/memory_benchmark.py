@@ -0,0 +1,143 @@
+# Peak memory of decoding a large Databento range, whole vs chunked.
+#
+#   python -m benchmarks.memory_benchmark
+#   python -m benchmarks.memory_benchmark --records 500000 2000000 --chunk-rows 100000
+#
+# A synthetic mbp-1 DBN file of each size is written once, the download is faked by
+# copying it to the requested path. Every mode runs in a fresh process and reports its
+# peak RSS (ru_maxrss), minus the RSS after the imports:
+#
+#   to_df       DBNStore.to_df() of the whole range, the path before the chunked decoding
+#   download    cache fill only: decode + write parquet CHUNK_ROWS records at a time
+#   iter_range  download + read back chunk by chunk, nothing kept (the bound of the cache)
+#   load_mbp    what /opt-nbbo-hf holds: the projected columns of the whole range
+#   downsample  load_mbp for a maxPoints chart: only the rows that change the top of book
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+MODES = ("to_df", "download", "iter_range", "load_mbp", "downsample")
+T0 = 1746108000_000000000  # 2025-05-01 14:00 UTC
+SPACING_NS = 1_000_000
+
+
+def _peak_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def write_dbn(path, records, symbol="AAPL"):
+    import databento_dbn as dbn
+
+    class Interval:
+        def __init__(self, start_date, end_date, symbol):
+            self.start_date, self.end_date, self.symbol = start_date, end_date, symbol
+
+    class Mapping:
+        def __init__(self, raw_symbol, intervals):
+            self.raw_symbol, self.intervals = raw_symbol, intervals
+
+    metadata = dbn.Metadata(
+        dataset="XNAS.ITCH",
+        schema=dbn.Schema.MBP_1,
+        start=T0,
+        end=T0 + records * SPACING_NS,
+        stype_in=dbn.SType.RAW_SYMBOL,
+        stype_out=dbn.SType.INSTRUMENT_ID,
+        symbols=[symbol],
+        mappings=[Mapping(symbol, [Interval(datetime.date(2025, 5, 1), datetime.date(2025, 5, 2), "1")])],
+    )
+
+    rng = np.random.default_rng(1)
+    mid = 211.0 + np.cumsum(rng.normal(0, 0.01, records))
+    bid = np.round((mid - 0.005) * 100).astype(np.int64) * 10_000_000
+    bid_size = rng.integers(1, 4, records)
+    trade = rng.random(records) < 0.1
+
+    with open(path, "wb") as f:
+        f.write(bytes(metadata.encode()))
+        for i in range(records):
+            levels = dbn.BidAskPair(bid_px=int(bid[i]), ask_px=int(bid[i]) + 10_000_000, bid_sz=int(bid_size[i]), ask_sz=2)
+            record = dbn.MBP1Msg(
+                publisher_id=1, instrument_id=1, ts_event=T0 + i * SPACING_NS, ts_recv=T0 + i * SPACING_NS + 5,
+                price=int(bid[i]) + 10_000_000 if trade[i] else int(bid[i]), size=1,
+                action=dbn.Action.TRADE if trade[i] else dbn.Action.ADD, side=dbn.Side.NONE, depth=0, levels=levels,
+            )
+            f.write(bytes(record))
+
+
+def _measure(mode, dbn_path, records, chunk_rows, results):
+    cache_dir = tempfile.mkdtemp()
+    os.environ["MARKET_CACHE_DIR"] = cache_dir
+    os.environ["MARKET_CHUNK_ROWS"] = str(chunk_rows)
+
+    import databento as db
+    import pandas as pd
+    from market_data import cache, client
+    from market_data.tables import load_mbp
+
+    def fake_get_range(path=None, **kwargs):
+        if path is None:
+            return db.DBNStore.from_file(dbn_path)
+        shutil.copyfile(dbn_path, path)
+        return db.DBNStore.from_file(path)
+
+    client.get_range = fake_get_range
+    start = pd.Timestamp(T0, tz="UTC")
+    end = start + pd.Timedelta(records * SPACING_NS, unit="ns")
+    baseline = _peak_mb()
+    began = time.perf_counter()
+
+    rows = 0
+    if mode == "to_df":
+        rows = len(fake_get_range().to_df())
+    elif mode == "download":
+        cache._fill("XNAS.ITCH", "mbp-1", "AAPL", start.value, end.value, "raw_symbol")
+    elif mode == "iter_range":
+        for chunk in cache.iter_range(dataset="XNAS.ITCH", schema="mbp-1", symbols="AAPL", start=start, end=end):
+            rows += len(chunk)
+    else:
+        rows = len(load_mbp("XNAS.ITCH", "mbp-1", "AAPL", start, end, 1000 if mode == "downsample" else None))
+
+    results.put((mode, records, rows, _peak_mb() - baseline, time.perf_counter() - began))
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, nargs="+", default=[250_000, 1_000_000, 2_000_000])
+    parser.add_argument("--chunk-rows", type=int, default=250_000)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'records':>10} {'mode':<11} {'rows':>10} {'peak MB':>9} {'seconds':>8}")
+        for records in args.records:
+            dbn_path = os.path.join(work_dir, f"mbp1-{records}.dbn")
+            write_dbn(dbn_path, records)
+
+            for mode in args.modes:
+                results = context.Queue()
+                process = context.Process(target=_measure, args=(mode, dbn_path, records, args.chunk_rows, results))
+                process.start()
+                mode, records, rows, peak_mb, seconds = results.get()
+                process.join()
+                print(f"{records:>10} {mode:<11} {rows:>10} {peak_mb:>9.1f} {seconds:>8.2f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
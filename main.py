@@ -1,4 +1,7 @@
 from news_data import fetch_news
+from market_data.warmer import start_warmer
 
 
+# market data cache warming runs next to the news loop (needs MARKET_WARM_WATCHLIST)
+start_warmer()
 fetch_news()
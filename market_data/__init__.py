@@ -1,3 +1,6 @@
-from market_data.tables import fetch_hf_iv, equity_lf, decode_option_ticker, fetch_multi_iv
-from market_data.opt_model import option_solver
-from market_data.option_def import get_option_definitions
\ No newline at end of file
+from market_data.tables import fetch_hf_iv, equity_lf, decode_option_ticker, decode_option_tickers, fetch_multi_iv
+from market_data.opt_model import option_solver, option_solver_batch
+from market_data.option_def import get_option_definitions
+from market_data.surface import fetch_iv_surface
+from market_data.strategy import fetch_strategy
+from market_data.scanner import fetch_chain_activity
@@ -0,0 +1,489 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from market_data import client as databento_client
+from market_data import usage
+
+
+# Local cache for Databento get_range results.
+#
+# Every (dataset, schema, stype_in, symbol) gets its own directory holding a
+# manifest of the time ranges already downloaded and one parquet file per range:
+#
+#   {CACHE_DIR}/{dataset}/{schema}/{stype_in}/{symbol}/manifest.json
+#   {CACHE_DIR}/{dataset}/{schema}/{stype_in}/{symbol}/{start_ns}-{end_ns}.parquet
+#
+# A request is split into the parts already on disk and the gaps, only the gaps are
+# downloaded. Ranges that are not settled yet (too close to now) are fetched but never
+# stored, so a historical range is downloaded exactly once.
+#
+# Series computed from the data (IV, see market_data.iv_store) are kept the same way
+# under {CACHE_DIR}/_derived/{name}/{symbol}.
+
+CACHE_DIR = os.getenv(
+    "MARKET_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), ".cache", "market_data"),
+)
+
+# data newer than this is still being published by Databento, do not store it
+SETTLE_DELAY = pd.Timedelta(minutes=int(os.getenv("MARKET_CACHE_SETTLE_MINUTES", "15")))
+
+# records decoded / read per chunk, bounds the memory of downloads and iter_range
+CHUNK_ROWS = int(os.getenv("MARKET_CHUNK_ROWS", "250000"))
+
+
+def _to_utc(ts):
+    ts = pd.Timestamp(ts)
+    if ts.tzinfo is None:
+        return ts.tz_localize("UTC")
+    return ts.tz_convert("UTC")
+
+
+def _key_dir(dataset, schema, symbol, stype_in):
+    return os.path.join(
+        CACHE_DIR,
+        quote(str(dataset), safe=""),
+        quote(str(schema), safe=""),
+        quote(str(stype_in), safe=""),
+        quote(str(symbol), safe=""),
+    )
+
+
+@contextmanager
+def _locked(key_dir):
+    # serialize manifest updates between the gunicorn workers
+    os.makedirs(key_dir, exist_ok=True)
+    with open(os.path.join(key_dir, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_manifest(key_dir):
+    path = os.path.join(key_dir, "manifest.json")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(key_dir, segments):
+    path = os.path.join(key_dir, "manifest.json")
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(segments, f)
+    os.replace(tmp_path, path)
+
+
+def missing_ranges(segments, start_ns, end_ns):
+    """Return the [start, end) sub-ranges of the request not covered by any segment."""
+    gaps = []
+    cursor = start_ns
+
+    for seg_start, seg_end, _ in sorted(segments, key=lambda s: s[0]):
+        if seg_end <= cursor:
+            continue
+        if seg_start >= end_ns:
+            break
+        if seg_start > cursor:
+            gaps.append((cursor, seg_start))
+        cursor = max(cursor, seg_end)
+        if cursor >= end_ns:
+            break
+
+    if cursor < end_ns:
+        gaps.append((cursor, end_ns))
+
+    return gaps
+
+
+def _register_segment(key_dir, start_ns, end_ns, file_name):
+    with _locked(key_dir):
+        segments = _read_manifest(key_dir)
+        segments.append([start_ns, end_ns, file_name])
+        _write_manifest(key_dir, segments)
+
+
+class _SegmentWriter:
+    """Appends DataFrame chunks to one parquet segment, registered in the manifest on close."""
+
+    def __init__(self, key_dir, start_ns, end_ns):
+        self.key_dir = key_dir
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.file_name = f"{start_ns}-{end_ns}.parquet"
+        self.path = os.path.join(key_dir, self.file_name)
+        self.tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        self.writer = None
+        self.empty = None
+
+    def write(self, df):
+        if df.empty:
+            # keep the columns, an empty range still needs a readable file
+            if self.empty is None:
+                self.empty = df
+            return
+        table = pa.Table.from_pandas(df)
+        if self.writer is None:
+            os.makedirs(self.key_dir, exist_ok=True)
+            self.writer = pq.ParquetWriter(self.tmp_path, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is None:
+            os.makedirs(self.key_dir, exist_ok=True)
+            (self.empty if self.empty is not None else pd.DataFrame()).to_parquet(self.tmp_path, engine="pyarrow")
+        else:
+            self.writer.close()
+        os.replace(self.tmp_path, self.path)
+        _register_segment(self.key_dir, self.start_ns, self.end_ns, self.file_name)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _slice(df, start_ns, end_ns):
+    # the to_df() index is the timestamp Databento filters get_range on
+    if df.empty:
+        return df
+    index_ns = df.index.as_unit("ns").asi8
+    return df[(index_ns >= start_ns) & (index_ns < end_ns)]
+
+
+def _segment_parts(segments, start_ns, end_ns):
+    # segments can overlap if two workers filled the same gap, take every instant once
+    covered_until = start_ns
+    for seg_start, seg_end, file_name in sorted(segments, key=lambda s: s[0]):
+        lo = max(seg_start, covered_until)
+        hi = min(seg_end, end_ns)
+        if lo >= hi:
+            continue
+        yield file_name, lo, hi
+        covered_until = max(covered_until, seg_end)
+
+
+def _read_segments(key_dir, segments, start_ns, end_ns, columns=None):
+    frames = []
+    for file_name, lo, hi in _segment_parts(segments, start_ns, end_ns):
+        df = pd.read_parquet(os.path.join(key_dir, file_name), engine="pyarrow", memory_map=True, columns=columns)
+        frames.append(_slice(df, lo, hi))
+    return frames
+
+
+def _iter_segment(path, start_ns, end_ns, columns, batch_rows):
+    parquet = pq.ParquetFile(path, memory_map=True)
+    pandas_meta = parquet.schema_arrow.pandas_metadata or {}
+    # the index column has to come along to slice on it and restore it
+    index_columns = [c for c in pandas_meta.get("index_columns", []) if isinstance(c, str)]
+    read_columns = None if columns is None else [*index_columns, *(c for c in columns if c not in index_columns)]
+
+    for batch in parquet.iter_batches(batch_size=batch_rows, columns=read_columns):
+        df = _slice(pa.Table.from_batches([batch]).to_pandas(), start_ns, end_ns)
+        if not df.empty:
+            yield df
+
+
+def _download(dataset, schema, symbol, stype_in, start_ns, end_ns):
+    df = databento_client.get_range(
+        dataset=dataset,
+        schema=schema,
+        symbols=symbol,
+        stype_in=stype_in,
+        start=pd.Timestamp(start_ns, tz="UTC"),
+        end=pd.Timestamp(end_ns, tz="UTC"),
+    ).to_df()
+    usage.record_records(dataset, schema, len(df))
+    return df
+
+
+def _download_segments(key_dirs, dataset, schema, symbols, stype_in, start_ns, end_ns):
+    """
+    Download a settled range straight into parquet segments, one per key dir.
+
+    The response is streamed to a DBN file next to the segments and decoded CHUNK_ROWS
+    records at a time, so memory is bounded by the chunk size, not by the range.
+    With several key dirs (multi-symbol) every chunk is split on its symbol column.
+    """
+    first_dir = next(iter(key_dirs.values()))
+    os.makedirs(first_dir, exist_ok=True)
+    dbn_path = os.path.join(first_dir, f"{start_ns}-{end_ns}.{uuid.uuid4().hex}.dbn.zst")
+    writers = {symbol: _SegmentWriter(key_dir, start_ns, end_ns) for symbol, key_dir in key_dirs.items()}
+
+    try:
+        store = databento_client.get_range(
+            dataset=dataset,
+            schema=schema,
+            symbols=symbols,
+            stype_in=stype_in,
+            start=pd.Timestamp(start_ns, tz="UTC"),
+            end=pd.Timestamp(end_ns, tz="UTC"),
+            path=dbn_path,
+        )
+
+        chunks = 0
+        for chunk in store.to_df(count=CHUNK_ROWS):
+            chunks += 1
+            usage.record_records(dataset, schema, len(chunk))
+            if len(writers) == 1:
+                next(iter(writers.values())).write(chunk)
+            else:
+                for symbol, df_symbol in _split_by_symbol(chunk, list(writers)).items():
+                    writers[symbol].write(df_symbol)
+        if chunks == 0:
+            # no records: an empty frame with the schema's columns
+            empty = store.to_df()
+            for writer in writers.values():
+                writer.write(empty)
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    finally:
+        if os.path.exists(dbn_path):
+            os.remove(dbn_path)
+
+    for writer in writers.values():
+        writer.close()
+
+
+def _fill(dataset, schema, symbols, start_ns, end_ns, stype_in):
+    """Download the settled gaps into segments, return (key_dir, segments, unsettled tail frames)."""
+    settled_ns = (pd.Timestamp.now(tz="UTC") - SETTLE_DELAY).value
+    key_dir = _key_dir(dataset, schema, symbols, stype_in)
+    segments = _read_manifest(key_dir)
+
+    tail = []
+    stored = False
+    for gap_start, gap_end in missing_ranges(segments, start_ns, end_ns):
+        # settled part is stored, the recent tail is only returned
+        if gap_start < settled_ns:
+            _download_segments({symbols: key_dir}, dataset, schema, symbols, stype_in, gap_start, min(gap_end, settled_ns))
+            stored = True
+
+        if gap_end > settled_ns:
+            tail.append(_download(dataset, schema, symbols, stype_in, max(gap_start, settled_ns), gap_end))
+
+    if stored:
+        segments = _read_manifest(key_dir)
+    return key_dir, segments, tail
+
+
+def get_range(dataset, schema, symbols, start, end, stype_in="raw_symbol", columns=None):
+    """Cached drop-in for `Historical.timeseries.get_range(...).to_df()`."""
+    start_ns = _to_utc(start).value
+    end_ns = _to_utc(end).value
+    stype_in = str(getattr(stype_in, "value", stype_in))
+
+    key_dir, segments, tail = _fill(dataset, schema, symbols, start_ns, end_ns, stype_in)
+    if columns is not None:
+        tail = [df[[c for c in columns if c in df.columns]] for df in tail]
+
+    return _combine(_read_segments(key_dir, segments, start_ns, end_ns, columns) + tail)
+
+
+def iter_range(dataset, schema, symbols, start, end, stype_in="raw_symbol", columns=None, batch_rows=None):
+    """
+    get_range as a generator of time ordered chunks of at most `batch_rows` rows.
+
+    Only `columns` (plus the index) are read, so a consumer that reduces every chunk
+    holds one chunk of the range at a time.
+    """
+    start_ns = _to_utc(start).value
+    end_ns = _to_utc(end).value
+    stype_in = str(getattr(stype_in, "value", stype_in))
+    batch_rows = batch_rows or CHUNK_ROWS
+
+    key_dir, segments, tail = _fill(dataset, schema, symbols, start_ns, end_ns, stype_in)
+
+    for file_name, lo, hi in _segment_parts(segments, start_ns, end_ns):
+        yield from _iter_segment(os.path.join(key_dir, file_name), lo, hi, columns, batch_rows)
+
+    # the unsettled tail is at most SETTLE_DELAY long
+    for df in tail:
+        if columns is not None:
+            df = df[[c for c in columns if c in df.columns]]
+        for i in range(0, len(df), batch_rows):
+            yield df.iloc[i:i + batch_rows]
+
+
+def _combine(frames):
+    non_empty = [df for df in frames if not df.empty]
+
+    if not non_empty:
+        return frames[0] if frames else pd.DataFrame()
+    if len(non_empty) == 1:
+        return non_empty[0]
+
+    # stable sort keeps the original record order for equal timestamps
+    return pd.concat(non_empty).sort_index(kind="stable")
+
+
+def _split_by_symbol(df, symbols):
+    # multi-symbol to_df() frames carry the raw symbol in the "symbol" column
+    if df.empty or "symbol" not in df.columns:
+        return {symbol: df for symbol in symbols}
+    groups = {symbol: group for symbol, group in df.groupby("symbol", sort=False)}
+    return {symbol: groups.get(symbol, df.iloc[0:0]) for symbol in symbols}
+
+
+def get_range_multi(dataset, schema, symbols, start, end, columns=None):
+    """
+    Cached multi-symbol get_range for raw symbols, returns {symbol: DataFrame}.
+
+    Symbols missing the same sub-range are downloaded together in one request,
+    the result is split per symbol and cached under each symbol's own key.
+    """
+    start_ns = _to_utc(start).value
+    end_ns = _to_utc(end).value
+    settled_ns = (pd.Timestamp.now(tz="UTC") - SETTLE_DELAY).value
+    symbols = list(dict.fromkeys(symbols))
+
+    key_dirs = {symbol: _key_dir(dataset, schema, symbol, "raw_symbol") for symbol in symbols}
+    manifests = {symbol: _read_manifest(key_dirs[symbol]) for symbol in symbols}
+
+    by_gap = defaultdict(list)
+    for symbol in symbols:
+        for gap in missing_ranges(manifests[symbol], start_ns, end_ns):
+            by_gap[gap].append(symbol)
+
+    tail = defaultdict(list)
+    for (gap_start, gap_end), gap_symbols in by_gap.items():
+        if gap_start < settled_ns:
+            _download_segments(
+                {symbol: key_dirs[symbol] for symbol in gap_symbols},
+                dataset, schema, gap_symbols, "raw_symbol", gap_start, min(gap_end, settled_ns),
+            )
+
+        if gap_end > settled_ns:
+            df = _download(dataset, schema, gap_symbols, "raw_symbol", max(gap_start, settled_ns), gap_end)
+            for symbol, df_symbol in _split_by_symbol(df, gap_symbols).items():
+                if columns is not None:
+                    df_symbol = df_symbol[[c for c in columns if c in df_symbol.columns]]
+                tail[symbol].append(df_symbol)
+
+    return {
+        symbol: _combine(_read_segments(key_dirs[symbol], _read_manifest(key_dirs[symbol]), start_ns, end_ns, columns) + tail[symbol])
+        for symbol in symbols
+    }
+
+
+def prefetch(dataset, schema, symbols, start, end, stype_in="raw_symbol"):
+    """
+    Download the settled, missing part of a range into the cache without reading it.
+
+    A list of raw symbols is cached per symbol like get_range_multi. Returns the number
+    of Databento requests made, 0 when everything was on disk already.
+    """
+    start_ns = _to_utc(start).value
+    end_ns = min(_to_utc(end).value, (pd.Timestamp.now(tz="UTC") - SETTLE_DELAY).value)
+    stype_in = str(getattr(stype_in, "value", stype_in))
+    if end_ns <= start_ns:
+        return 0
+
+    if isinstance(symbols, str):
+        key_dirs = {symbols: _key_dir(dataset, schema, symbols, stype_in)}
+    else:
+        key_dirs = {symbol: _key_dir(dataset, schema, symbol, stype_in) for symbol in dict.fromkeys(symbols)}
+
+    by_gap = defaultdict(list)
+    for symbol, key_dir in key_dirs.items():
+        for gap in missing_ranges(_read_manifest(key_dir), start_ns, end_ns):
+            by_gap[gap].append(symbol)
+
+    for (gap_start, gap_end), gap_symbols in by_gap.items():
+        request_symbols = symbols if isinstance(symbols, str) else gap_symbols
+        _download_segments({symbol: key_dirs[symbol] for symbol in gap_symbols}, dataset, schema, request_symbols, stype_in, gap_start, gap_end)
+    return len(by_gap)
+
+
+def _derived_dir(name, symbol):
+    return os.path.join(CACHE_DIR, "_derived", quote(name, safe=""), quote(symbol, safe=""))
+
+
+def derived_gaps(name, symbol, start, end, settled=None):
+    """
+    Parts of [start, end) not stored for the derived series `name` of `symbol`, as
+    (gap_start, gap_end, storable). Only settled parts may be stored (see store_derived).
+    `settled` pins the settled boundary, so the gaps of several symbols line up.
+    """
+    start_ns = _to_utc(start).value
+    end_ns = _to_utc(end).value
+    settled_ns = _to_utc(settled).value if settled is not None else (pd.Timestamp.now(tz="UTC") - SETTLE_DELAY).value
+
+    gaps = []
+    for gap_start, gap_end in missing_ranges(_read_manifest(_derived_dir(name, symbol)), start_ns, end_ns):
+        if gap_start < settled_ns:
+            gaps.append((pd.Timestamp(gap_start, tz="UTC"), pd.Timestamp(min(gap_end, settled_ns), tz="UTC"), True))
+        if gap_end > settled_ns:
+            gaps.append((pd.Timestamp(max(gap_start, settled_ns), tz="UTC"), pd.Timestamp(gap_end, tz="UTC"), False))
+    return gaps
+
+
+def store_derived(name, symbol, start, end, df):
+    """Store a computed frame (timestamp index) for [start, end), same segments and manifest as get_range."""
+    writer = _SegmentWriter(_derived_dir(name, symbol), _to_utc(start).value, _to_utc(end).value)
+    try:
+        writer.write(df)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def read_derived(name, symbol, start, end):
+    key_dir = _derived_dir(name, symbol)
+    start_ns = _to_utc(start).value
+    end_ns = _to_utc(end).value
+    return _combine(_read_segments(key_dir, _read_manifest(key_dir), start_ns, end_ns))
+
+
+async def get_range_async(**kwargs):
+    # disk reads and downloads both block, keep them off the event loop
+    return await asyncio.to_thread(get_range, **kwargs)
+
+
+async def get_range_multi_async(**kwargs):
+    return await asyncio.to_thread(get_range_multi, **kwargs)
+
+
+def is_cached(dataset, schema, symbol, start, end, stype_in="raw_symbol"):
+    """True if the whole [start, end) range is already on disk."""
+    stype_in = str(getattr(stype_in, "value", stype_in))
+    segments = _read_manifest(_key_dir(dataset, schema, symbol, stype_in))
+    return not missing_ranges(segments, _to_utc(start).value, _to_utc(end).value)
+
+
+def clear_cache(older_than_days=None):
+    """Remove cached segments, all or only the ones written more than `older_than_days` ago."""
+    cutoff = None if older_than_days is None else time.time() - older_than_days * 86400
+
+    for root, _, files in os.walk(CACHE_DIR):
+        if "manifest.json" not in files:
+            continue
+
+        with _locked(root):
+            segments = _read_manifest(root)
+            keep = []
+            for segment in segments:
+                path = os.path.join(root, segment[2])
+                if cutoff is not None and os.path.exists(path) and os.path.getmtime(path) >= cutoff:
+                    keep.append(segment)
+                elif os.path.exists(path):
+                    os.remove(path)
+            _write_manifest(root, keep)
@@ -0,0 +1,153 @@
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+from databento import SType
+
+from market_data import cache
+from market_data.tables import decode_option_tickers
+
+
+# Per-day option chain index.
+#
+# The OPRA definition schema of {ticker}.OPT is decoded once per underlying and day into a
+# small frame (raw_symbol, expiration, strike_price, instrument_class), sorted by expiry,
+# strike and type. It is kept as parquet under {CACHE_DIR}/chain_index/{ticker}/{day}.parquet
+# and in a per-process LRU, filters and pages run on that frame only.
+#
+# Days that are not settled yet (see cache.SETTLE_DELAY) are built from the fresh
+# definitions every time and never stored.
+
+INDEX_DIR = os.path.join(cache.CACHE_DIR, "chain_index")
+MEMORY_ENTRIES = 64
+COLUMNS = ["raw_symbol", "expiration", "strike_price", "instrument_class"]
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_building = {}
+
+
+def _index_path(ticker, day):
+    return os.path.join(INDEX_DIR, quote(ticker, safe=""), f"{day:%Y-%m-%d}.parquet")
+
+
+def decode_chain(raw_symbols):
+    """Index frame of OCC symbols (see decode_option_tickers), symbols that are not OCC are left out."""
+    decoded = decode_option_tickers(pd.Series(raw_symbols, dtype=str).str.upper().drop_duplicates())
+    decoded = decoded[decoded["valid"]]
+    raw = decoded["option_ticker"]
+
+    df = pd.DataFrame({
+        "raw_symbol": raw.to_numpy(),
+        # sliced, strftime of tz-aware dates is much slower
+        "expiration": ("20" + raw.str[6:8] + "-" + raw.str[8:10] + "-" + raw.str[10:12]).to_numpy(),
+        "strike_price": decoded["strike_price"].to_numpy(dtype=float),
+        "instrument_class": decoded["type"].to_numpy(),
+    })
+    return df.sort_values(["expiration", "strike_price", "instrument_class"], kind="stable").reset_index(drop=True)
+
+
+def _build(ticker, day):
+    defs = cache.get_range(
+        dataset="OPRA.PILLAR",
+        schema="definition",
+        symbols=f"{ticker}.OPT",
+        stype_in=SType.PARENT,
+        start=day,
+        end=day + pd.Timedelta(days=1),
+    )
+    if defs.empty:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in zip(COLUMNS, [str, str, float, str])})
+    return decode_chain(defs["raw_symbol"])
+
+
+def _remember(key):
+    # caller holds _lock
+    if key in _memory:
+        _memory.move_to_end(key)
+        return _memory[key]
+    return None
+
+
+def load_chain(ticker, day):
+    """Chain index of `ticker` on `day` (a midnight Timestamp), built on first use."""
+    key = (ticker, day)
+    settled = day + pd.Timedelta(days=1) <= pd.Timestamp.now() - cache.SETTLE_DELAY
+
+    # the module lock only guards the LRU, a build (a definition download) holds the
+    # lock of its own key, so lookups of other chains never wait for it
+    with _lock:
+        chain = _remember(key)
+        if chain is not None:
+            return chain
+        build_lock = _building.setdefault(key, threading.Lock())
+
+    with build_lock:
+        try:
+            with _lock:
+                # built by the thread we waited for
+                chain = _remember(key)
+            if chain is not None:
+                return chain
+
+            path = _index_path(ticker, day)
+            if settled and os.path.exists(path):
+                chain = pd.read_parquet(path)
+            else:
+                chain = _build(ticker, day)
+                if not settled:
+                    return chain
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                chain.to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, path)
+
+            with _lock:
+                _memory[key] = chain
+                if len(_memory) > MEMORY_ENTRIES:
+                    _memory.popitem(last=False)
+            return chain
+        finally:
+            with _lock:
+                _building.pop(key, None)
+
+
+def underlying_close(ticker, day):
+    """Last daily close of the underlying up to `day`, None if there is none."""
+    bars = cache.get_range(
+        dataset="XNAS.ITCH",
+        schema="ohlcv-1d",
+        symbols=ticker,
+        start=day - pd.Timedelta(days=7),
+        end=day + pd.Timedelta(days=1),
+    )
+    if bars.empty:
+        return None
+    return float(bars["close"].iloc[-1])
+
+
+def filter_chain(chain, expiration=None, min_strike=None, max_strike=None, instrument_class=None,
+                 min_moneyness=None, max_moneyness=None, underlying_price=None):
+    # moneyness is strike / underlying price
+    mask = np.ones(len(chain), dtype=bool)
+
+    if expiration is not None:
+        mask &= chain["expiration"].to_numpy() == expiration
+    if instrument_class is not None:
+        mask &= chain["instrument_class"].to_numpy() == instrument_class
+
+    strike = chain["strike_price"].to_numpy()
+    if min_strike is not None:
+        mask &= strike >= min_strike
+    if max_strike is not None:
+        mask &= strike <= max_strike
+    if min_moneyness is not None:
+        mask &= strike >= min_moneyness * underlying_price
+    if max_moneyness is not None:
+        mask &= strike <= max_moneyness * underlying_price
+
+    return chain[mask]
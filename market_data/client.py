@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import databento.common.http as databento_http
+import requests
+from databento import Historical
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from requests.adapters import HTTPAdapter
+
+from market_data import usage
+
+
+# Process-wide Databento client.
+#
+# databento's http layer calls the module level `requests.get/post`, which opens a new
+# TLS connection for every request. We hand it a shared keep-alive Session instead, so
+# all market_data calls in a worker reuse warm connections. That reference is private to
+# databento: the version is pinned in requirements.txt and the import below fails if the
+# http layer stops using the requests module. Every call also takes a slot
+# of a semaphore, capping the requests this process has in flight towards Databento.
+#
+# get_range is priced through the metadata API first and counted in market_data.usage.
+# Endpoints wrap their fetches in fetch_errors(): a failed download becomes FetchFailed,
+# HTTP errors raised on the way (cost limit, busy pool) keep their status.
+
+# Load environment variables from .env file at project root
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
+DATABENTO_API_KEY = os.getenv("DATABENTO_API_KEY")
+
+MAX_CONCURRENCY = int(os.getenv("DATABENTO_MAX_CONCURRENCY", "4"))
+
+if getattr(databento_http, "requests", None) is not requests:
+    raise RuntimeError(
+        "databento.common.http no longer calls the requests module, the pooled client in "
+        "market_data.client needs updating for this databento version"
+    )
+
+_client = None
+_client_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+
+class _PooledRequests:
+    """Stands in for the `requests` module inside databento.common.http."""
+
+    def __init__(self, pool_size):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def get(self, **kwargs):
+        return self.session.get(**kwargs)
+
+    def post(self, **kwargs):
+        return self.session.post(**kwargs)
+
+
+def get_client():
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            if not isinstance(databento_http.requests, _PooledRequests):
+                databento_http.requests = _PooledRequests(MAX_CONCURRENCY)
+            _client = Historical(DATABENTO_API_KEY)
+
+    return _client
+
+
+COST_ARGS = ("dataset", "start", "end", "symbols", "schema", "stype_in", "limit")
+
+
+def get_cost(**kwargs):
+    """Estimated dollars of a get_range with the same arguments, free to ask."""
+    return get_client().metadata.get_cost(**{k: v for k, v in kwargs.items() if k in COST_ARGS})
+
+
+def get_range(**kwargs):
+    """`Historical.timeseries.get_range` on the shared client, returns the DBNStore."""
+    dataset = kwargs["dataset"]
+    schema = kwargs.get("schema", "trades")
+
+    with _slots:
+        cost = 0.0
+        if usage.MAX_REQUEST_COST > 0:
+            cost = get_cost(**kwargs)
+            usage.check_cost(dataset, schema, cost)
+
+        start = time.perf_counter()
+        try:
+            store = get_client().timeseries.get_range(**kwargs)
+        except Exception:
+            usage.record_call(dataset, schema, time.perf_counter() - start, error=True)
+            raise
+
+    usage.record_call(dataset, schema, time.perf_counter() - start, store.nbytes, cost)
+    return store
+
+
+class FetchFailed(HTTPException):
+    """A Databento fetch that failed for any other reason than an HTTP error of ours."""
+
+
+@contextmanager
+def fetch_errors(status_code=500, detail=None):
+    try:
+        yield
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise FetchFailed(status_code=status_code, detail=detail or f"Error fetching data from Databento: {e}") from e
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+from market_data.pricing import IV_OK
+
+
+# Visual downsampling for the high-frequency chart series.
+#
+# min/max per bucket: the series is cut into equal time buckets and only the lowest and
+#   highest price of every bucket is kept (in time order). Every local extreme a chart of
+#   that width can show survives, so no trade spike or quote gap gets lost.
+# LTTB (largest triangle three buckets): keeps the point of each bucket that spans the
+#   largest triangle with its neighbours, preserves the shape of smooth series like IV.
+
+MIN_POINTS = 10
+MAX_POINTS = 10_000
+
+
+def _time_ns(df):
+    return pd.DatetimeIndex(df["ts_event"]).as_unit("ns").asi8
+
+
+def _buckets(ts, n_buckets):
+    span = max(int(ts[-1]) - int(ts[0]), 1)
+    return np.minimum((ts - ts[0]).astype(np.float64) * n_buckets // span, n_buckets - 1).astype(np.int64)
+
+
+def minmax_indices(ts, y, n_buckets):
+    """Row positions of the min and max `y` of every time bucket, sorted."""
+    if len(y) <= 2 * n_buckets:
+        return np.arange(len(y))
+
+    groups = pd.Series(y).groupby(_buckets(ts, n_buckets), sort=False)
+    keep = np.concatenate([groups.idxmin().to_numpy(), groups.idxmax().to_numpy(), [0, len(y) - 1]])
+    return np.unique(keep)
+
+
+def lttb_indices(x, y, n_out):
+    """Row positions picked by largest-triangle-three-buckets, first and last always kept."""
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    # inner buckets over rows 1 .. n-2
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+
+        # average of the next bucket (or the last point) is the third triangle corner
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], edges[i + 2])
+            cx, cy = x[nxt].mean(), y[nxt].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+
+    return keep
+
+
+def downsample_minmax(df, max_points, column="price"):
+    if len(df) <= max_points:
+        return df
+    idx = minmax_indices(_time_ns(df), df[column].to_numpy(dtype=float), max(max_points // 2, 1))
+    return df.iloc[idx].reset_index(drop=True)
+
+
+def downsample_lttb(df, max_points, column="iv"):
+    if "iv_status" in df.columns:
+        # unsolved rows have no value to draw
+        df = df[df["iv_status"] == IV_OK]
+    if len(df) <= max_points:
+        return df.reset_index(drop=True)
+    idx = lttb_indices(_time_ns(df), df[column].to_numpy(dtype=float), max_points)
+    return df.iloc[idx].reset_index(drop=True)
+
+
+def validate_max_points(max_points):
+    # the cap keeps a downsampled page (16 hours of ticks) small
+    if max_points is not None and not MIN_POINTS <= max_points <= MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"maxPoints must be between {MIN_POINTS} and {MAX_POINTS}.")
+    return max_points
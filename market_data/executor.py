@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from fastapi import HTTPException
+
+
+# Bounded process pool for the CPU heavy part of the market endpoints
+# (merge_asof, IV solving, formatting / encoding). The event loop only awaits it, so a
+# few IV requests no longer hold the GIL of the worker that also serves /search.
+#
+# At most MARKET_CPU_WORKERS jobs run at once, MARKET_CPU_MAX_QUEUE more may wait,
+# anything beyond that is rejected with 503 instead of piling up. A pool whose child died
+# (OOM kill, segfault) is dropped and built again, the requests it took down get 503.
+
+CPU_WORKERS = int(os.getenv("MARKET_CPU_WORKERS", "2"))
+MAX_QUEUE = int(os.getenv("MARKET_CPU_MAX_QUEUE", "16"))
+
+_pool = None
+_in_flight = 0
+_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "rejected": 0,
+    "broken_pools": 0,
+    "max_queue_depth": 0,
+    "total_seconds": 0.0,
+}
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: never fork a process that already runs an event loop and client threads
+        _pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    # only the pool that broke, a replacement may already be in use
+    if _pool is pool:
+        _pool = None
+        _stats["broken_pools"] += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _call(fn, *args, **kwargs):
+    # HTTPException does not survive pickling, hand back its fields instead
+    try:
+        return True, fn(*args, **kwargs)
+    except HTTPException as e:
+        return False, (e.status_code, e.detail)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) in the process pool and await the result."""
+    global _in_flight
+
+    if _in_flight >= CPU_WORKERS + MAX_QUEUE:
+        _stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly.")
+
+    _in_flight += 1
+    _stats["submitted"] += 1
+    _stats["max_queue_depth"] = max(_stats["max_queue_depth"], _in_flight - CPU_WORKERS)
+    start = time.perf_counter()
+
+    pool = _get_pool()
+    try:
+        loop = asyncio.get_running_loop()
+        ok, result = await loop.run_in_executor(pool, partial(_call, fn, *args, **kwargs))
+    except BrokenProcessPool:
+        _stats["failed"] += 1
+        _discard_pool(pool)
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly.")
+    except Exception:
+        _stats["failed"] += 1
+        raise
+    finally:
+        _in_flight -= 1
+        _stats["total_seconds"] += time.perf_counter() - start
+
+    if not ok:
+        _stats["failed"] += 1
+        status_code, detail = result
+        raise HTTPException(status_code=status_code, detail=detail)
+
+    _stats["completed"] += 1
+    return result
+
+
+def metrics():
+    finished = _stats["completed"] + _stats["failed"]
+    return {
+        "workers": CPU_WORKERS,
+        "max_queue": MAX_QUEUE,
+        "in_flight": _in_flight,
+        "queue_depth": max(_in_flight - CPU_WORKERS, 0),
+        **_stats,
+        "avg_seconds": _stats["total_seconds"] / finished if finished else 0.0,
+    }
@@ -0,0 +1,74 @@
+import asyncio
+from collections import defaultdict
+
+import pandas as pd
+
+from market_data import cache
+
+
+# Computed IV series, stored per contract so a range is only solved once.
+#
+# Series are kept as parquet segments with a manifest, like the raw data (cache.py),
+# indexed by ts_event under {CACHE_DIR}/_derived/{series}/{contract}. The series name
+# holds the inputs and the risk free rate, a change of either starts a new series:
+#
+#   trades-r{rate}      /multi-iv: option trades vs the nearest underlying trade
+#   mbp-trades-r{rate}  /opt-nbbo-hf: the same from the mbp-1 / cmbp-1 books
+#   mbp-quotes-r{rate}  /opt-nbbo-hf ivSource=quotes: every NBBO mid change
+#
+# Greeks are always stored, requests without them drop the columns. Ranges that are not
+# settled yet are solved every time and never stored.
+
+
+def series_name(source, rate):
+    return f"{source}-r{rate}"
+
+
+async def series_gaps(names, start, end):
+    """{(gap_start, gap_end, storable): [symbols]} of the parts of `names` not stored over [start, end)."""
+    # one settled boundary for all symbols, their gaps are shared
+    settled = pd.Timestamp.now(tz="UTC") - cache.SETTLE_DELAY
+    by_gap = defaultdict(list)
+    for symbol, name in names.items():
+        for gap in await asyncio.to_thread(cache.derived_gaps, name, symbol, start, end, settled):
+            by_gap[gap].append(symbol)
+    return by_gap
+
+
+async def cached_series(names, start, end, compute, gaps=None):
+    """
+    {symbol: frame} of the stored series `names` ({symbol: series name}) over [start, end).
+
+    Only the missing parts are computed: `await compute(gap_start, gap_end, symbols)`
+    returns {symbol: frame with ts_event} for every symbol missing that same gap, so
+    contracts with the same gap share one computation. `gaps` (from series_gaps) pins
+    the missing parts of a caller that already fetched their inputs.
+    """
+    if gaps is None:
+        by_gap = await series_gaps(names, start, end)
+    else:
+        by_gap = {gap: [symbol for symbol in symbols if symbol in names] for gap, symbols in gaps.items()}
+
+    fresh = defaultdict(list)
+    for (gap_start, gap_end, storable), symbols in by_gap.items():
+        if not symbols:
+            continue
+        frames = await compute(gap_start, gap_end, symbols)
+        for symbol in symbols:
+            df = frames[symbol]
+            if storable:
+                await asyncio.to_thread(cache.store_derived, names[symbol], symbol, gap_start, gap_end, df.set_index("ts_event"))
+            else:
+                fresh[symbol].append(df)
+
+    out = {}
+    for symbol, name in names.items():
+        stored = await asyncio.to_thread(cache.read_derived, name, symbol, start, end)
+        # no stored segment at all when the whole range is fresh
+        parts = ([stored.reset_index()] if len(stored.columns) else []) + fresh[symbol]
+        non_empty = [df for df in parts if not df.empty]
+        if non_empty:
+            out[symbol] = pd.concat(non_empty, ignore_index=True).sort_values("ts_event", kind="stable").reset_index(drop=True)
+        else:
+            out[symbol] = parts[0]
+    return out
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import os
+import time
+
+import databento as db
+import numpy as np
+import pandas as pd
+
+from market_data.client import DATABENTO_API_KEY
+from market_data.pricing import implied_volatility, IV_OK
+from market_data.tables import decode_option_ticker, RISK_FREE_RATE
+from market_data.timestamps import format_ts
+
+
+# Live NBBO + IV feed for one option contract, pushed over a websocket.
+#
+# An upstream yields normalized events of the underlying MBP-1 and the option CMBP-1:
+#   {"series": "underlying" | "option", "ts_event": ns, "action", "price", "size",
+#    "bid", "ask", "bid_size", "ask_size"}
+#
+#   MARKET_LIVE_UPSTREAM=databento  Databento Live, one session per dataset (default)
+#   MARKET_LIVE_UPSTREAM=replay     DBN files from MARKET_LIVE_REPLAY_FILES (comma separated),
+#                                   played back at MARKET_LIVE_REPLAY_SPEED x real time
+#                                   (0 = as fast as possible)
+#
+# One LiveFeed per contract and worker fans the upstream out to all its websockets.
+# Every FLUSH_SECONDS the new events are sent as one message:
+#   {"type": "delta", "events": [...]}
+# quote events carry the top of book (and the mid IV for the option), option trades the
+# trade IV against the last underlying trade. A new client first gets a "snapshot" with the
+# latest quote and trade of both series, a finished upstream sends {"type": "end"}.
+
+UPSTREAM = os.getenv("MARKET_LIVE_UPSTREAM", "databento")
+REPLAY_FILES = [p for p in os.getenv("MARKET_LIVE_REPLAY_FILES", "").split(",") if p]
+REPLAY_SPEED = float(os.getenv("MARKET_LIVE_REPLAY_SPEED", "1"))
+
+FLUSH_SECONDS = 0.1
+REPLAY_YIELD_EVENTS = 1000  # an unpaced replay yields to the event loop this often
+MAX_PENDING_MESSAGES = 500  # a client this far behind is disconnected
+
+YEAR_SECONDS = 3600 * 24 * 365.25
+
+
+def _px(value):
+    return float("nan") if value == db.UNDEF_PRICE else value / 1e9
+
+
+def _record_event(series, record):
+    return {
+        "series": series,
+        "ts_event": record.ts_event,
+        "action": str(record.action),
+        "price": _px(record.price),
+        "size": record.size,
+        "bid": _px(record.bid_px_00),
+        "ask": _px(record.ask_px_00),
+        "bid_size": record.bid_sz_00,
+        "ask_size": record.ask_sz_00,
+    }
+
+
+class DatabentoLiveUpstream:
+    def __init__(self, underlying_ticker, option_ticker):
+        self.subscriptions = [
+            ("underlying", "XNAS.ITCH", "mbp-1", underlying_ticker, db.MBP1Msg),
+            ("option", "OPRA.PILLAR", "cmbp-1", option_ticker, db.CMBP1Msg),
+        ]
+
+    async def _pump(self, series, client, record_type, queue):
+        try:
+            async for record in client:
+                if isinstance(record, record_type):
+                    queue.put_nowait(_record_event(series, record))
+        finally:
+            queue.put_nowait(None)
+
+    async def events(self):
+        queue = asyncio.Queue()
+        clients = []
+        tasks = []
+
+        try:
+            for series, dataset, schema, symbol, record_type in self.subscriptions:
+                client = db.Live(key=DATABENTO_API_KEY)
+                clients.append(client)
+                # connect and authentication block, keep them off the event loop
+                await asyncio.to_thread(client.subscribe, dataset=dataset, schema=schema, symbols=symbol)
+                tasks.append(asyncio.create_task(self._pump(series, client, record_type, queue)))
+
+            while True:
+                event = await queue.get()
+                # either session ended
+                if event is None:
+                    return
+                yield event
+        finally:
+            for task in tasks:
+                task.cancel()
+            for client in clients:
+                try:
+                    client.terminate()
+                except ValueError:
+                    pass
+
+
+class ReplayUpstream:
+    def __init__(self, underlying_ticker, option_ticker, paths=None, speed=None):
+        self.symbols = {"underlying": underlying_ticker, "option": option_ticker}
+        self.schemas = {"mbp-1": "underlying", "cmbp-1": "option"}
+        self.paths = REPLAY_FILES if paths is None else paths
+        self.speed = REPLAY_SPEED if speed is None else speed
+
+    def _load(self):
+        frames = []
+        for path in self.paths:
+            store = db.DBNStore.from_file(path)
+            series = self.schemas.get(str(store.schema))
+            if series is None:
+                continue
+
+            df = store.to_df(pretty_ts=False)
+            if "symbol" in df.columns:
+                df = df[df["symbol"] == self.symbols[series]]
+            frames.append(pd.DataFrame({
+                "series": series,
+                "ts_event": df["ts_event"].to_numpy(dtype=np.int64),
+                "action": df["action"].to_numpy(),
+                "price": df["price"].to_numpy(dtype=float),
+                "size": df["size"].to_numpy(dtype=np.int64),
+                "bid": df["bid_px_00"].to_numpy(dtype=float),
+                "ask": df["ask_px_00"].to_numpy(dtype=float),
+                "bid_size": df["bid_sz_00"].to_numpy(dtype=np.int64),
+                "ask_size": df["ask_sz_00"].to_numpy(dtype=np.int64),
+            }))
+
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames).sort_values("ts_event", kind="stable")
+
+    async def events(self):
+        df = await asyncio.to_thread(self._load)
+
+        start_wall = time.monotonic()
+        start_ts = None
+        for i, event in enumerate(df.to_dict(orient="records")):
+            if start_ts is None:
+                start_ts = event["ts_event"]
+
+            # keep the recorded spacing, scaled by speed
+            if self.speed > 0:
+                delay = (event["ts_event"] - start_ts) / 1e9 / self.speed - (time.monotonic() - start_wall)
+                if delay > 0.001:
+                    await asyncio.sleep(delay)
+
+            # unpaced or behind schedule the loop never sleeps, let the flusher run now and then
+            if i % REPLAY_YIELD_EVENTS == REPLAY_YIELD_EVENTS - 1:
+                await asyncio.sleep(0)
+
+            yield event
+
+
+def make_upstream(underlying_ticker, option_ticker):
+    if UPSTREAM == "replay":
+        return ReplayUpstream(underlying_ticker, option_ticker)
+    return DatabentoLiveUpstream(underlying_ticker, option_ticker)
+
+
+class Subscriber:
+    def __init__(self, ts_format):
+        self.ts_format = ts_format
+        self.queue = asyncio.Queue()
+
+
+class LiveFeed:
+    def __init__(self, option_ticker):
+        option_ticker, underlying_ticker, expiration_date, strike_price, t = decode_option_ticker(option_ticker)
+        self.option_ticker = option_ticker
+        self.underlying_ticker = underlying_ticker
+        self.expiration_ns = pd.Timestamp(expiration_date).value
+        self.strike_price = strike_price
+        self.type = t
+
+        self.subscribers = set()
+        self.task = None
+        self.pending = []
+        # latest quote and trade per series, for the snapshot of new clients
+        self.last = {}
+        self.underlying_price = None
+
+    def _iv(self, price, ts_event):
+        t = (self.expiration_ns - ts_event) / 1e9 / YEAR_SECONDS
+        iv, status = implied_volatility(
+            np.array([price]), np.array([self.underlying_price]), self.strike_price, np.array([t]), RISK_FREE_RATE, self.type
+        )
+        return float(iv[0]), int(status[0])
+
+    def _update(self, event):
+        series = event["series"]
+        ts_event = event["ts_event"]
+
+        if event["action"] == "T" and not np.isnan(event["price"]):
+            update = {"type": "trade", "series": series, "ts_event": ts_event, "price": event["price"], "size": event["size"]}
+
+            if series == "underlying":
+                self.underlying_price = event["price"]
+            elif self.underlying_price is not None:
+                update["underlying_price"] = self.underlying_price
+                update["iv"], update["iv_status"] = self._iv(event["price"], ts_event)
+
+            self.last[(series, "trade")] = update
+            return update
+
+        # quote: only changes of the top of book are worth a delta
+        quote = (event["bid"], event["ask"], event["bid_size"], event["ask_size"])
+        previous = self.last.get((series, "quote"))
+        if previous is not None and previous["quote"] == quote:
+            return None
+
+        update = {"type": "quote", "series": series, "ts_event": ts_event, "bid": event["bid"], "ask": event["ask"],
+                  "bid_size": event["bid_size"], "ask_size": event["ask_size"]}
+        if series == "option" and self.underlying_price is not None and not np.isnan(event["bid"] + event["ask"]):
+            update["iv"], update["iv_status"] = self._iv((event["bid"] + event["ask"]) / 2, ts_event)
+
+        self.last[(series, "quote")] = {**update, "quote": quote}
+        return update
+
+    def _encode(self, message_type, updates, ts_format):
+        ts = format_ts(pd.to_datetime([u["ts_event"] for u in updates], utc=True), ts_format)
+        events = []
+        for update, ts_event in zip(updates, ts):
+            event = {k: v for k, v in update.items() if k != "quote"}
+            event["ts_event"] = ts_event
+            # NaN is no JSON, an unsolved IV is null like in the other endpoints
+            if "iv" in event and event["iv_status"] != IV_OK:
+                event["iv"] = None
+            events.append({k: (None if isinstance(v, float) and np.isnan(v) else v) for k, v in event.items()})
+        return json.dumps({"type": message_type, "events": events}, allow_nan=False)
+
+    def _send(self, subscriber, message):
+        if subscriber.queue.qsize() > MAX_PENDING_MESSAGES:
+            # too slow, drop it instead of buffering without bound
+            self.subscribers.discard(subscriber)
+            subscriber.queue.put_nowait(None)
+            return
+        subscriber.queue.put_nowait(message)
+
+    def _flush(self):
+        if not self.pending:
+            return
+        updates, self.pending = self.pending, []
+
+        # encode once per timestamp format in use
+        messages = {}
+        for subscriber in list(self.subscribers):
+            if subscriber.ts_format not in messages:
+                messages[subscriber.ts_format] = self._encode("delta", updates, subscriber.ts_format)
+            self._send(subscriber, messages[subscriber.ts_format])
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(FLUSH_SECONDS)
+            self._flush()
+
+    async def _run(self):
+        flusher = asyncio.create_task(self._flusher())
+        try:
+            async for event in make_upstream(self.underlying_ticker, self.option_ticker).events():
+                update = self._update(event)
+                if update is not None:
+                    self.pending.append(update)
+        finally:
+            flusher.cancel()
+            self._flush()
+            for subscriber in list(self.subscribers):
+                self._send(subscriber, json.dumps({"type": "end"}))
+                subscriber.queue.put_nowait(None)
+            self.subscribers.clear()
+            _drop_feed(self)
+
+    def subscribe(self, ts_format):
+        subscriber = Subscriber(ts_format)
+        if self.last:
+            subscriber.queue.put_nowait(self._encode("snapshot", list(self.last.values()), ts_format))
+        self.subscribers.add(subscriber)
+
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self.task is not None:
+            # last client gone, close the upstream
+            self.task.cancel()
+            _drop_feed(self)
+
+
+_feeds = {}
+
+
+def _drop_feed(feed):
+    # a newer feed for the same contract may already be registered
+    if _feeds.get(feed.option_ticker) is feed:
+        del _feeds[feed.option_ticker]
+
+
+def get_feed(option_ticker):
+    option_ticker = decode_option_ticker(option_ticker)[0]
+    if option_ticker not in _feeds:
+        _feeds[option_ticker] = LiveFeed(option_ticker)
+    return _feeds[option_ticker]
+
+
+async def _wait_for_disconnect(websocket):
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def serve(websocket, option_ticker, ts_format):
+    """Push the feed of `option_ticker` to an accepted websocket until either side ends."""
+    feed = get_feed(option_ticker)
+    subscriber = feed.subscribe(ts_format)
+    disconnected = asyncio.create_task(_wait_for_disconnect(websocket))
+
+    try:
+        while True:
+            getter = asyncio.create_task(subscriber.queue.get())
+            done, _ = await asyncio.wait({getter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                return
+
+            message = getter.result()
+            if message is None:
+                await websocket.close()
+                return
+            await websocket.send_text(message)
+    finally:
+        disconnected.cancel()
+        feed.unsubscribe(subscriber)
@@ -6,6 +6,8 @@ import pandas as pd
 from py_vollib.black_scholes.implied_volatility import implied_volatility
 from py_vollib.black_scholes import black_scholes
 from scipy.optimize import brentq
+import numpy as np
+from market_data.pricing import bs_price, find_root, implied_volatility as vectorized_iv
 
 
 def option_solver(r, vol, s, t, type, u, price, solveFor, timeUnits):
@@ -130,3 +132,98 @@ def option_solver(r, vol, s, t, type, u, price, solveFor, timeUnits):
         
         except ValueError:
             raise HTTPException(status_code=400, detail="No solution found for underlying price.")
+
+
+# Batch / grid mode: every numeric input is a scalar, a list, or a range
+# {"start", "stop", "num"}. Without `grid` the lists are solved element-wise (same length),
+# with `grid` the named inputs become the axes of the result matrix, in that order.
+
+BATCH_INPUTS = ("r", "vol", "s", "t", "u", "price")
+BATCH_MAX_POINTS = 250_000
+
+# search brackets for the targets without a closed form, as in option_solver
+BATCH_BRACKETS = {
+    "t": (1 / (365 * 24 * 60 * 60), 10),
+    "s": (0.01, 1_000_000),
+    "r": (-1.0, 1.0),
+    "u": (0.01, 1_000_000),
+}
+
+TIME_UNITS = {"y": 1.0, "d": 365.0, "h": 365.0 * 24.0}
+
+
+def _batch_values(name, value):
+    if isinstance(value, dict):
+        try:
+            num = int(value["num"])
+            values = np.linspace(float(value["start"]), float(value["stop"]), num)
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Invalid range for {name}. Use start, stop and num.")
+        if num < 1:
+            raise HTTPException(status_code=400, detail=f"Invalid range for {name}. num must be at least 1.")
+        return values
+    return np.asarray(value, dtype=float)
+
+
+def option_solver_batch(r, vol, s, t, type, u, price, solveFor, timeUnits, grid=None):
+    if solveFor not in ("vol", "price", *BATCH_BRACKETS):
+        raise HTTPException(status_code=400, detail="Invalid solveFor. Use vol, price, t, s, r or u.")
+    if timeUnits not in TIME_UNITS:
+        raise HTTPException(status_code=400, detail="Invalid timeUnits. Use y, d or h.")
+
+    inputs = {name: _batch_values(name, value) for name, value in zip(BATCH_INPUTS, (r, vol, s, t, u, price))}
+    grid = list(grid or [])
+
+    if len(set(grid)) != len(grid) or any(name not in BATCH_INPUTS or name == solveFor for name in grid):
+        raise HTTPException(status_code=400, detail=f"Invalid grid. Use distinct inputs out of {', '.join(BATCH_INPUTS)} other than solveFor.")
+
+    axes = {}
+    if grid:
+        # every grid input gets its own dimension, the rest must be scalars
+        for name in BATCH_INPUTS:
+            if name not in grid and inputs[name].ndim > 0:
+                raise HTTPException(status_code=400, detail=f"{name} must be a scalar in grid mode.")
+        for i, name in enumerate(grid):
+            axes[name] = np.atleast_1d(inputs[name])
+            shape = [1] * len(grid)
+            shape[i] = axes[name].size
+            inputs[name] = axes[name].reshape(shape)
+    else:
+        lengths = {inputs[name].size for name in BATCH_INPUTS if name != solveFor and inputs[name].ndim > 0}
+        if len(lengths) > 1 or any(inputs[name].ndim > 1 for name in BATCH_INPUTS):
+            raise HTTPException(status_code=400, detail="All list inputs must be flat and of the same length.")
+
+    shape = np.broadcast_shapes(*(inputs[name].shape for name in BATCH_INPUTS if name != solveFor))
+    if int(np.prod(shape)) > BATCH_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Too many points. Limit is {BATCH_MAX_POINTS:,}.")
+
+    flag = type[0].lower()
+    r, vol, s, u, price = (inputs[name] for name in ("r", "vol", "s", "u", "price"))
+    t = inputs["t"] / TIME_UNITS[timeUnits]
+
+    with np.errstate(all="ignore"):
+        if solveFor == "price":
+            values = bs_price(flag, u, s, t, r, vol)
+        elif solveFor == "vol":
+            values, _ = vectorized_iv(price, u, s, t, r, flag)
+        else:
+            residual = {
+                "t": lambda x: bs_price(flag, u, s, x, r, vol) - price,
+                "s": lambda x: bs_price(flag, u, x, t, r, vol) - price,
+                "r": lambda x: bs_price(flag, u, s, t, x, vol) - price,
+                "u": lambda x: bs_price(flag, x, s, t, r, vol) - price,
+            }[solveFor]
+            values, _ = find_root(residual, *BATCH_BRACKETS[solveFor])
+            if solveFor == "t":
+                values = values * TIME_UNITS[timeUnits]
+
+    values = np.round(np.broadcast_to(values, shape).astype(float), 3)
+    # no solution -> null
+    values = np.where(np.isfinite(values), values, None)
+
+    return {
+        "solveFor": solveFor,
+        "shape": list(shape),
+        "axes": {name: axis.tolist() for name, axis in axes.items()},
+        "values": values.tolist(),
+    }
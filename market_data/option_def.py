@@ -1,54 +1,64 @@
 from fastapi import FastAPI, Query, HTTPException
 from datetime import datetime
-from databento import Historical, SType
 import pandas as pd
 from fastapi.responses import JSONResponse
-from .tables import decode_option_ticker
+from .chain_index import load_chain, filter_chain, underlying_close
+from .client import fetch_errors, FetchFailed
+from .singleflight import single_flight
 
-from dotenv import load_dotenv
-import os
 
+PAGE_SIZE = 500
 
-# Load environment variables from .env file at project root
-load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
-DATABENTO_API_KEY = os.getenv("DATABENTO_API_KEY")
-
-
-
-def get_option_definitions(start_date: str, ticker: str):
+@single_flight
+def get_option_definitions(start_date: str, ticker: str, expiration=None, min_strike=None, max_strike=None,
+                           instrument_class=None, min_moneyness=None, max_moneyness=None, underlying_price=None, page=None):
     # parse to datetime
     try:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d")
-        end_date = start_date + pd.Timedelta(days=1)
+        start_date = pd.Timestamp(datetime.strptime(start_date, "%Y-%m-%d"))
+        if expiration is not None:
+            expiration = datetime.strptime(expiration, "%Y-%m-%d").strftime("%Y-%m-%d")
     except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use DD-MM-YYYY.")
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+    
+    if instrument_class is not None:
+        instrument_class = instrument_class.upper()
+        if instrument_class not in ("C", "P"):
+            raise HTTPException(status_code=400, detail="Invalid instrument class. Use C or P.")
+    
+    if page is not None and page < 1:
+        raise HTTPException(status_code=400, detail="Page starts at 1.")
     
     ticker = ticker.upper()
 
-    client = Historical(key=DATABENTO_API_KEY)
-
     try:
-        defs = client.timeseries.get_range(
-            dataset="OPRA.PILLAR",
-            schema="definition",
-            symbols=f"{ticker}.OPT",
-            stype_in=SType.PARENT,
-            start=start_date,
-            end=end_date
-        ).to_df()
-    except Exception as e:
+        with fetch_errors():
+            chain = load_chain(ticker, start_date)
+    except FetchFailed:
         return []
     
-    data = []
+    # moneyness band needs a price, default to the last close of the underlying
+    if (min_moneyness is not None or max_moneyness is not None) and underlying_price is None:
+        try:
+            with fetch_errors():
+                underlying_price = underlying_close(ticker, start_date)
+        except FetchFailed:
+            underlying_price = None
+        if underlying_price is None:
+            raise HTTPException(status_code=400, detail="No underlying price found, pass underlying_price.")
     
-    for row in defs.itertuples():
-        option_ticker, underlying_ticker, expiration_date, strike_price, t = decode_option_ticker(row.raw_symbol)
-        
-        data.append({
-            "raw_symbol": option_ticker,
-            "expiration": expiration_date.strftime('%Y-%m-%d'),
-            "strike_price": strike_price,
-            "instrument_class": t
-        })
-
-    return JSONResponse(content=data)
\ No newline at end of file
+    chain = filter_chain(
+        chain,
+        expiration=expiration,
+        min_strike=min_strike,
+        max_strike=max_strike,
+        instrument_class=instrument_class,
+        min_moneyness=min_moneyness,
+        max_moneyness=max_moneyness,
+        underlying_price=underlying_price,
+    )
+    
+    # without a page the whole (filtered) chain is returned
+    if page is not None:
+        chain = chain.iloc[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+    
+    return JSONResponse(content=chain.to_dict(orient="records"))
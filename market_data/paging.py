@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import json
+
+import pandas as pd
+from fastapi import HTTPException
+
+
+# Cursor pagination over time for the chart endpoints.
+#
+# A range longer than one page is answered one page at a time: the response covers
+# [page start, page end) and carries the continuation token in the X-Next-Cursor header.
+# The client repeats the same request with `cursor` set to it until the header is gone.
+#
+# The token holds the start of the next page and a fingerprint of the request it belongs
+# to, a token of another request (ticker, range, interval, ...) is rejected.
+
+CURSOR_HEADER = "X-Next-Cursor"
+
+
+def request_key(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def encode_cursor(next_start, key):
+    raw = json.dumps({"t": pd.Timestamp(next_start).value, "k": key}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, key):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        next_start, cursor_key = int(raw["t"]), raw["k"]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if cursor_key != key:
+        raise HTTPException(status_code=400, detail="Cursor belongs to a different request.")
+    return pd.Timestamp(next_start, tz="UTC")
+
+
+def page_window(start, end, page, key, cursor=None, align=None):
+    """
+    (page start, page end, next cursor) of the page `cursor` points to, the first one without.
+
+    `align` maps the raw page end onto a boundary (e.g. a bar edge), it must stay after
+    the page start. The next cursor is None on the last page.
+    """
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    page_start = start if cursor is None else decode_cursor(cursor, key)
+    if not start <= page_start < end:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+    page_end = page_start + page
+    if align is not None:
+        page_end = align(page_end)
+    if page_end >= end:
+        return page_start.to_pydatetime(), end.to_pydatetime(), None
+    return page_start.to_pydatetime(), page_end.to_pydatetime(), encode_cursor(page_end, key)
+
+
+def with_cursor(response, next_cursor):
+    if next_cursor is not None:
+        response.headers[CURSOR_HEADER] = next_cursor
+    return response
@@ -0,0 +1,224 @@
+import numpy as np
+from scipy.special import ndtr
+
+
+# Vectorized Black-Scholes (European, continuous rate, no dividends).
+# Every function takes scalars or NumPy arrays and broadcasts them together,
+# `flag` is "c" / "p" (or an array of them).
+
+# per-row status codes returned by implied_volatility
+IV_OK = 0
+IV_INVALID_INPUT = 1  # NaN, non-positive price / underlying / strike / time
+IV_BELOW_INTRINSIC = 2  # price at or below the discounted intrinsic value
+IV_ABOVE_MAX = 3  # price above the no-arbitrage upper bound (or above SIGMA_MAX)
+IV_NOT_CONVERGED = 4
+
+IV_STATUS_NAMES = {
+    IV_OK: "ok",
+    IV_INVALID_INPUT: "invalid_input",
+    IV_BELOW_INTRINSIC: "below_intrinsic",
+    IV_ABOVE_MAX: "above_max",
+    IV_NOT_CONVERGED: "not_converged",
+}
+
+SIGMA_MIN = 1e-6
+SIGMA_MAX = 10.0
+
+
+def _is_call(flag):
+    flag = np.asarray(flag)
+    if flag.dtype == bool:
+        return flag
+    return np.char.lower(flag.astype(str)) == "c"
+
+
+def _d1_d2(S, K, t, r, sigma):
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(S / K) + (r + 0.5 * sigma * sigma) * t) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def bs_price(flag, S, K, t, r, sigma):
+    is_call = _is_call(flag)
+    d1, d2 = _d1_d2(S, K, t, r, sigma)
+    discount = np.exp(-r * t)
+
+    call = S * ndtr(d1) - K * discount * ndtr(d2)
+    put = K * discount * ndtr(-d2) - S * ndtr(-d1)
+    return np.where(is_call, call, put)
+
+
+def bs_vega(S, K, t, r, sigma):
+    # d price / d sigma (per 1.00 of vol, not per vol point)
+    d1, _ = _d1_d2(S, K, t, r, sigma)
+    return S * np.exp(-0.5 * d1 * d1) / np.sqrt(2 * np.pi) * np.sqrt(t)
+
+
+GREEKS = ("delta", "gamma", "vega", "theta")
+
+
+def bs_greeks(flag, S, K, t, r, sigma):
+    """
+    delta, gamma, vega and theta from one d1/d2 evaluation.
+
+    Same units as py_vollib's analytical greeks: vega per vol point (0.01),
+    theta per calendar day. NaN sigma gives NaN greeks.
+    """
+    is_call = _is_call(flag)
+    d1, d2 = _d1_d2(S, K, t, r, sigma)
+    sqrt_t = np.sqrt(t)
+    pdf_d1 = np.exp(-0.5 * d1 * d1) / np.sqrt(2 * np.pi)
+    discount = np.exp(-r * t)
+
+    delta = np.where(is_call, ndtr(d1), ndtr(d1) - 1)
+    gamma = pdf_d1 / (S * sigma * sqrt_t)
+    vega = S * pdf_d1 * sqrt_t / 100
+    decay = -S * pdf_d1 * sigma / (2 * sqrt_t)
+    theta = np.where(is_call, decay - r * K * discount * ndtr(d2), decay + r * K * discount * ndtr(-d2)) / 365
+
+    return {"delta": delta, "gamma": gamma, "vega": vega, "theta": theta}
+
+
+def implied_volatility(price, S, K, t, r, flag, tol=1e-8, max_iter=100):
+    """
+    Solve Black-Scholes IV for all rows at once.
+
+    Safeguarded Newton: every row keeps a [lo, hi] bracket, Newton steps that leave
+    the bracket (or have a vanishing vega) fall back to bisection.
+    Returns (iv, status), iv is NaN wherever status != IV_OK.
+    """
+    price, S, K, t, r = np.broadcast_arrays(
+        *(np.asarray(x, dtype=np.float64) for x in (price, S, K, t, r))
+    )
+    is_call = np.broadcast_to(_is_call(flag), price.shape)
+
+    shape = price.shape
+    n = price.size
+    price, S, K, t, r, is_call = (x.ravel() for x in (price, S, K, t, r, is_call))
+
+    iv = np.full(n, np.nan)
+    status = np.full(n, IV_NOT_CONVERGED, dtype=np.int8)
+
+    with np.errstate(all="ignore"):
+        valid = np.isfinite(price) & np.isfinite(S) & np.isfinite(K) & np.isfinite(t) & np.isfinite(r)
+        valid &= (price > 0) & (S > 0) & (K > 0) & (t > 0)
+        status[~valid] = IV_INVALID_INPUT
+
+        discounted_k = K * np.exp(-r * t)
+        intrinsic = np.where(is_call, np.maximum(S - discounted_k, 0), np.maximum(discounted_k - S, 0))
+        upper = np.where(is_call, S, discounted_k)
+
+        below = valid & (price <= intrinsic)
+        above = valid & ~below & (price >= upper)
+        status[below] = IV_BELOW_INTRINSIC
+        status[above] = IV_ABOVE_MAX
+
+        idx = np.flatnonzero(valid & ~below & ~above)
+        if idx.size == 0:
+            return iv.reshape(shape), status.reshape(shape)
+
+        p, s, k, tt, rr, c = price[idx], S[idx], K[idx], t[idx], r[idx], is_call[idx]
+
+        # prices above the SIGMA_MAX price have no solution inside the bracket
+        too_high = p > bs_price(c, s, k, tt, rr, SIGMA_MAX)
+        status[idx[too_high]] = IV_ABOVE_MAX
+        keep = ~too_high
+        idx, p, s, k, tt, rr, c = idx[keep], p[keep], s[keep], k[keep], tt[keep], rr[keep], c[keep]
+
+        lo = np.full(idx.size, SIGMA_MIN)
+        hi = np.full(idx.size, SIGMA_MAX)
+
+        # Brenner-Subrahmanyam style starting point, clipped into the bracket
+        sigma = np.sqrt(2 * np.abs(np.log(s / k) + rr * tt) / tt)
+        sigma = np.where(sigma < 0.05, np.sqrt(2 * np.pi / tt) * p / s, sigma)
+        sigma = np.clip(sigma, 0.01, 5.0)
+
+        active = np.arange(idx.size)
+        for _ in range(max_iter):
+            if active.size == 0:
+                break
+
+            sa = sigma[active]
+            diff = bs_price(c[active], s[active], k[active], tt[active], rr[active], sa) - p[active]
+            vega = bs_vega(s[active], k[active], tt[active], rr[active], sa)
+
+            # price is increasing in sigma, tighten the bracket
+            lo[active] = np.where(diff < 0, sa, lo[active])
+            hi[active] = np.where(diff > 0, sa, hi[active])
+
+            step = diff / vega
+            newton = sa - step
+            bisect = 0.5 * (lo[active] + hi[active])
+            use_newton = np.isfinite(newton) & (newton > lo[active]) & (newton < hi[active])
+            new_sigma = np.where(use_newton, newton, bisect)
+
+            # converge on sigma, a price tolerance is meaningless for deep ITM / far OTM rows
+            done = (diff == 0) | (np.abs(new_sigma - sa) < tol)
+            sigma[active] = np.where(done, sa, new_sigma)
+            active = active[~done]
+
+        converged = np.ones(idx.size, dtype=bool)
+        converged[active] = False
+
+        iv[idx[converged]] = sigma[converged]
+        status[idx[converged]] = IV_OK
+
+    return iv.reshape(shape), status.reshape(shape)
+
+
+def find_root(f, lo, hi, xtol=1e-12, max_iter=200):
+    """
+    Vectorized bracketed root finder (Illinois variant of regula falsi).
+
+    f maps an array of x (shaped like lo / hi) to an array of residuals. Every element
+    keeps its own [lo, hi] bracket, steps that leave it fall back to bisection.
+    Returns (x, found), x is NaN wherever f has no sign change on the bracket or the
+    iteration did not converge.
+    """
+    with np.errstate(all="ignore"):
+        # scalar brackets are fine, the residuals define the shape
+        f_lo = np.asarray(f(np.asarray(lo, dtype=np.float64)), dtype=np.float64)
+        f_hi = np.asarray(f(np.asarray(hi, dtype=np.float64)), dtype=np.float64)
+        shape = np.broadcast_shapes(np.shape(lo), np.shape(hi), f_lo.shape, f_hi.shape)
+        lo, hi, f_lo, f_hi = (np.array(np.broadcast_to(v, shape), dtype=np.float64).ravel() for v in (lo, hi, f_lo, f_hi))
+
+        x = np.full(lo.size, np.nan)
+        x = np.where(f_lo == 0, lo, np.where(f_hi == 0, hi, x))
+        found = np.isfinite(x)
+
+        active = np.isfinite(f_lo) & np.isfinite(f_hi) & (np.sign(f_lo) * np.sign(f_hi) < 0)
+        # which end was replaced last: -1 lo, +1 hi
+        side = np.zeros(lo.size, dtype=np.int8)
+
+        for _ in range(max_iter):
+            if not active.any():
+                break
+
+            x_new = (lo * f_hi - hi * f_lo) / (f_hi - f_lo)
+            a, b = np.minimum(lo, hi), np.maximum(lo, hi)
+            outside = ~np.isfinite(x_new) | (x_new <= a) | (x_new >= b)
+            x_new = np.where(outside, 0.5 * (lo + hi), x_new)
+
+            fx = np.asarray(f(np.where(active, x_new, lo).reshape(shape)), dtype=np.float64).ravel()
+
+            same_as_hi = np.sign(fx) == np.sign(f_hi)
+            move_hi = active & same_as_hi
+            move_lo = active & ~same_as_hi
+
+            # Illinois: the end that stays twice in a row gets its residual halved
+            f_lo = np.where(move_hi & (side == 1), 0.5 * f_lo, f_lo)
+            f_hi = np.where(move_lo & (side == -1), 0.5 * f_hi, f_hi)
+            hi = np.where(move_hi, x_new, hi)
+            f_hi = np.where(move_hi, fx, f_hi)
+            lo = np.where(move_lo, x_new, lo)
+            f_lo = np.where(move_lo, fx, f_lo)
+            side = np.where(move_hi, 1, np.where(move_lo, -1, side)).astype(np.int8)
+
+            done = active & ((fx == 0) | (np.abs(x_new - x) <= xtol * (1 + np.abs(x_new))) | (np.abs(hi - lo) <= xtol * (1 + np.abs(x_new))))
+            x = np.where(active, x_new, x)
+            found |= done
+            active &= ~done
+
+        x = np.where(found, x, np.nan)
+
+    return x.reshape(shape), found.reshape(shape)
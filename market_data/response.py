@@ -0,0 +1,150 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from market_data.pricing import GREEKS, IV_OK
+from market_data.timestamps import format_ts
+
+
+# Response encodings for the tick endpoints (/opt-nbbo-hf, /multi-iv), picked from the
+# Accept header:
+#
+#   application/json                       -> list of {"ts_event", "price", ...} per series (default)
+#   application/vnd.rflx.columnar+json     -> {"ts_event": [...], "price": [...], ...} per series
+#   application/vnd.apache.arrow.stream    -> one Arrow IPC stream, all series stacked with a
+#                                             "series" column, the JSON metadata in the schema,
+#                                             timestamps stay native UTC (tsFormat is ignored)
+#   application/x-ndjson                   -> (/multi-iv only) streamed lines, first the metadata,
+#                                             then {"series": name, "data": [records]} chunks,
+#                                             underlying first, every contract as soon as it is solved
+#
+# Every series is a DataFrame with a UTC "ts_event" column plus value columns.
+# iv and the greeks are null wherever iv_status is not IV_OK.
+
+IV_COLUMNS = ("iv", *GREEKS)
+
+RECORDS = "records"
+COLUMNAR = "columnar"
+ARROW = "arrow"
+NDJSON = "ndjson"
+
+MEDIA_TYPES = {
+    "application/json": RECORDS,
+    "application/vnd.rflx.columnar+json": COLUMNAR,
+    "application/vnd.apache.arrow.stream": ARROW,
+    "application/x-ndjson": NDJSON,
+}
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_CHUNK_ROWS = 20000
+
+
+def negotiate(accept):
+    # first known media type in the Accept header wins, anything else gets the old format
+    for media_type in (accept or "").split(","):
+        media_type = media_type.split(";")[0].strip().lower()
+        if media_type in MEDIA_TYPES:
+            return MEDIA_TYPES[media_type]
+    return RECORDS
+
+
+def _column_lists(df):
+    values = {col: df[col].tolist() for col in df.columns if col != "ts_event"}
+
+    # unsolved IV rows are null, the reason is in iv_status
+    if "iv_status" in values:
+        for col in IV_COLUMNS:
+            if col in values:
+                values[col] = [v if status == IV_OK else None for v, status in zip(values[col], values["iv_status"])]
+
+    return values
+
+
+def series_records(df, ts_format):
+    values = _column_lists(df)
+    keys = ["ts_event", *values.keys()]
+    return [dict(zip(keys, row)) for row in zip(format_ts(df["ts_event"], ts_format), *values.values())]
+
+
+def series_columns(df, ts_format):
+    return {"ts_event": format_ts(df["ts_event"], ts_format), **_column_lists(df)}
+
+
+def encode_series(df, fmt, ts_format):
+    if fmt == COLUMNAR:
+        return series_columns(df, ts_format)
+    return series_records(df, ts_format)
+
+
+def arrow_response(meta, series):
+    """Stack the named series into one Arrow table and return it as an IPC stream."""
+    tables = []
+    for df in series.values():
+        columns = {}
+        for col in df.columns:
+            values = df[col]
+            if col == "ts_event":
+                columns[col] = pa.array(pd.DatetimeIndex(values).as_unit("ns"), pa.timestamp("ns", tz="UTC"))
+            elif col in IV_COLUMNS and "iv_status" in df.columns:
+                columns[col] = pa.array(values.to_numpy(dtype=float), mask=(df["iv_status"] != IV_OK).to_numpy())
+            else:
+                columns[col] = pa.array(values.to_numpy())
+        tables.append(pa.table(columns))
+
+    # permissive: integer columns of different widths (uint32 sizes vs int64 counts) widen instead of failing
+    table = pa.concat_tables(tables, promote_options="permissive") if tables else pa.table({})
+
+    # series name as a dictionary column, one int32 code per row
+    codes = np.repeat(np.arange(len(series), dtype=np.int32), [len(df) for df in series.values()])
+    table = table.add_column(0, "series", pa.DictionaryArray.from_arrays(codes, list(series.keys())))
+    table = table.replace_schema_metadata({"meta": json.dumps(meta)})
+
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return Response(content=sink.getvalue(), media_type=ARROW_MEDIA_TYPE)
+
+
+def json_response(content, fmt):
+    media_type = "application/vnd.rflx.columnar+json" if fmt == COLUMNAR else "application/json"
+    return JSONResponse(content=content, media_type=media_type)
+
+
+def json_items(values):
+    # the items of a JSON array without its brackets, for arrays written piece by piece
+    return json.dumps(values, separators=(",", ":"), allow_nan=False, ensure_ascii=False)[1:-1].encode()
+
+
+def series_record_items(df, ts_format):
+    return json_items(series_records(df, ts_format))
+
+
+def series_column_items(df, column, ts_format):
+    return json_items(series_columns(df, ts_format)[column])
+
+
+def json_stream_response(parts, fmt):
+    media_type = "application/vnd.rflx.columnar+json" if fmt == COLUMNAR else "application/json"
+    return StreamingResponse(parts, media_type=media_type)
+
+
+def ndjson_meta(content):
+    return json.dumps(content, separators=(",", ":"), allow_nan=False).encode() + b"\n"
+
+
+def ndjson_lines(name, df, ts_format):
+    """NDJSON lines of one series, at most NDJSON_CHUNK_ROWS records per line."""
+    lines = []
+    for start in range(0, max(len(df), 1), NDJSON_CHUNK_ROWS):
+        chunk = df.iloc[start:start + NDJSON_CHUNK_ROWS]
+        lines.append(ndjson_meta({"series": name, "data": series_records(chunk, ts_format)}))
+    return b"".join(lines)
+
+
+def ndjson_response(lines):
+    return StreamingResponse(lines, media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,168 @@
+import asyncio
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from databento import SType
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from market_data import cache
+from market_data.chain_index import decode_chain, filter_chain
+from market_data.client import fetch_errors
+from market_data.executor import run_cpu
+from market_data.singleflight import single_flight
+from market_data.timestamps import NY_TZ
+
+
+# Most active contracts of a chain on one day.
+#
+# ONE parent-symbol request ({ticker}.OPT) for the whole chain, read chunk by chunk and
+# reduced per contract with a groupby, then joined to the chain decoded from the symbols:
+#
+#   source=ohlcv   bars: volume, premium estimated from the bars' typical price
+#                  ((high + low + close) / 3). Daily bars for past days, minute bars for
+#                  the running day (its daily bar only exists after the close)
+#   source=trades  every trade of the day (New York time): volume, exact premium,
+#                  trade count, VWAP and last price
+#
+# Premium is in dollars (price x size x 100).
+
+SCAN_SOURCES = ("ohlcv", "trades")
+SCAN_METRICS = ("volume", "premium", "trades")
+SCAN_MAX_TOP = 500
+CONTRACT_MULTIPLIER = 100
+
+PARTIAL_COLUMNS = ["volume", "premium", "trades"]
+
+
+def _partial(chunk, source):
+    # per contract sums of one chunk, the last price of the chunk per contract
+    if source == "trades":
+        df = pd.DataFrame({
+            "symbol": chunk["symbol"].to_numpy(),
+            "volume": chunk["size"].to_numpy(dtype=float),
+            "premium": chunk["price"].to_numpy(dtype=float) * chunk["size"].to_numpy(dtype=float),
+            "trades": 1,
+            "last": chunk["price"].to_numpy(dtype=float),
+        })
+    else:
+        typical = (chunk["high"].to_numpy(dtype=float) + chunk["low"].to_numpy(dtype=float) + chunk["close"].to_numpy(dtype=float)) / 3
+        df = pd.DataFrame({
+            "symbol": chunk["symbol"].to_numpy(),
+            "volume": chunk["volume"].to_numpy(dtype=float),
+            "premium": typical * chunk["volume"].to_numpy(dtype=float),
+            "trades": np.nan,
+            "last": chunk["close"].to_numpy(dtype=float),
+        })
+    grouped = df.groupby("symbol", sort=False)
+    return grouped[PARTIAL_COLUMNS].sum(min_count=1).join(grouped["last"].last())
+
+
+def aggregate_activity(ticker, source, start, end):
+    """Volume, premium, trades and last price per contract symbol over [start, end)."""
+    if source == "trades":
+        schema, columns = "trades", ["symbol", "price", "size"]
+    else:
+        # complete days only come as daily bars
+        schema = "ohlcv-1d" if end <= pd.Timestamp.now(tz="UTC") - cache.SETTLE_DELAY else "ohlcv-1m"
+        columns = ["symbol", "high", "low", "close", "volume"]
+
+    partials = []
+    for chunk in cache.iter_range(dataset="OPRA.PILLAR", schema=schema, symbols=f"{ticker}.OPT", stype_in=SType.PARENT,
+                                  start=start, end=end, columns=columns):
+        if not chunk.empty:
+            partials.append(_partial(chunk, source))
+
+    if not partials:
+        return pd.DataFrame({col: pd.Series(dtype=float) for col in [*PARTIAL_COLUMNS, "last"]}, index=pd.Index([], name="symbol", dtype=str))
+
+    # chunks are in time order, the last chunk holding a contract has its last price
+    combined = pd.concat(partials)
+    grouped = combined.groupby(level="symbol", sort=False)
+    return grouped[PARTIAL_COLUMNS].sum(min_count=1).join(grouped["last"].last())
+
+
+def build_activity(activity, source, metric, top, expiration=None, instrument_class=None, min_strike=None, max_strike=None):
+    chain = filter_chain(decode_chain(activity.index), expiration=expiration, instrument_class=instrument_class,
+                         min_strike=min_strike, max_strike=max_strike)
+    chain = chain.merge(activity, left_on="raw_symbol", right_index=True, how="inner")
+    chain["volume"] = chain["volume"].astype("int64")
+    if source == "trades":
+        chain["trades"] = chain["trades"].astype("int64")
+    chain["premium"] *= CONTRACT_MULTIPLIER
+    chain["vwap"] = np.where(chain["volume"] > 0, chain["premium"] / (chain["volume"] * CONTRACT_MULTIPLIER), np.nan)
+
+    is_call = chain["instrument_class"].to_numpy() == "C"
+    totals = {
+        "contracts": int(len(chain)),
+        "volume": int(chain["volume"].sum()),
+        "premium": float(chain["premium"].sum()),
+        "call_volume": int(chain["volume"].to_numpy()[is_call].sum()),
+        "put_volume": int(chain["volume"].to_numpy()[~is_call].sum()),
+    }
+    if source == "trades":
+        totals["trades"] = int(chain["trades"].sum())
+
+    # ties keep the chain order (expiry, strike, type)
+    chain = chain.sort_values(metric, ascending=False, kind="stable").head(top)
+
+    columns = ["raw_symbol", "expiration", "strike_price", "instrument_class", "volume", "premium", "vwap", "last"]
+    if source == "trades":
+        columns.insert(6, "trades")
+    rows = chain[columns].astype(object)
+    rows = rows.where(rows.notna(), None)
+
+    return JSONResponse(content={
+        "source": source,
+        "metric": metric,
+        "totals": totals,
+        "contracts": rows.to_dict(orient="records"),
+    })
+
+
+@single_flight
+async def fetch_chain_activity(ticker, day=None, source="ohlcv", metric="volume", top=25, expiration=None, instrument_class=None,
+                               min_strike=None, max_strike=None):
+    ticker = ticker.upper()
+    source = source.lower()
+    metric = metric.lower()
+    if source not in SCAN_SOURCES:
+        raise HTTPException(status_code=400, detail="Invalid source. Use ohlcv or trades.")
+    if metric not in SCAN_METRICS:
+        raise HTTPException(status_code=400, detail="Invalid metric. Use volume, premium or trades.")
+    if metric == "trades" and source != "trades":
+        raise HTTPException(status_code=400, detail="The trades metric needs source=trades.")
+    if not 1 <= top <= SCAN_MAX_TOP:
+        raise HTTPException(status_code=400, detail=f"top must be between 1 and {SCAN_MAX_TOP}.")
+    if instrument_class is not None:
+        instrument_class = instrument_class.upper()
+        if instrument_class not in ("C", "P"):
+            raise HTTPException(status_code=400, detail="Invalid type. Use C or P.")
+
+    if day is None:
+        day = pd.Timestamp.now(tz=NY_TZ).strftime("%Y-%m-%d")
+    try:
+        for value in (day, expiration):
+            if value is not None:
+                datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+
+    if source == "trades":
+        # the trading day in New York time
+        start = pd.Timestamp(day, tz=NY_TZ).tz_convert("UTC")
+        end = (pd.Timestamp(day, tz=NY_TZ) + pd.Timedelta(days=1)).tz_convert("UTC")
+    else:
+        # daily bars are stamped with their UTC date
+        start = pd.Timestamp(day, tz="UTC")
+        end = start + pd.Timedelta(days=1)
+    end = min(end, pd.Timestamp.now(tz="UTC"))
+    if start >= end:
+        raise HTTPException(status_code=400, detail="The day has not started yet.")
+
+    with fetch_errors():
+        activity = await asyncio.to_thread(aggregate_activity, ticker, source, start, end)
+
+    return await run_cpu(build_activity, activity, source, metric, top, expiration=expiration, instrument_class=instrument_class,
+                         min_strike=min_strike, max_strike=max_strike)
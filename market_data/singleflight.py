@@ -0,0 +1,190 @@
+import asyncio
+import fcntl
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import time
+
+from fastapi import HTTPException
+
+from market_data.cache import CACHE_DIR
+
+
+# Request coalescing for the market endpoints.
+#
+# Identical calls that overlap in time share one computation:
+#   - inside a worker, later callers await the future of the first one
+#   - across the gunicorn workers, the first caller holds an fcntl lock on
+#     {CACHE_DIR}/_inflight/{key}.lock, callers in the other worker wait for the lock and
+#     take its result instead of downloading again. While they wait they keep {key}.waiting
+#     touched, the result is only written to {key}.pkl if that marker is there
+#
+# A stored result is only used by callers that started waiting before it was written,
+# nothing is served from here afterwards (the range cache handles that).
+
+INFLIGHT_DIR = os.path.join(CACHE_DIR, "_inflight")
+WAIT_TIMEOUT = float(os.getenv("MARKET_SINGLEFLIGHT_TIMEOUT", "120"))
+POLL_SECONDS = 0.05
+RESULT_TTL = 300
+
+_inflight = {}
+_stats = {"leaders": 0, "coalesced": 0, "shared_across_workers": 0}
+
+
+def _key(fn, args, kwargs):
+    # positional and keyword spellings of the same call map to the same key
+    bound = inspect.signature(fn).bind(*args, **kwargs)
+    bound.apply_defaults()
+    raw = repr((fn.__module__, fn.__qualname__, sorted(bound.arguments.items())))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _read_result(path, waited_from):
+    try:
+        with open(path, "rb") as f:
+            finished_at, ok, value = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    # written before we started waiting: a result of an earlier, unrelated call
+    if finished_at < waited_from:
+        return None
+    return ok, value
+
+
+def _write_result(path, ok, value):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump((time.time(), ok, value), f)
+        os.replace(tmp_path, path)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        # not picklable: the other worker just computes on its own
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _touch(path):
+    try:
+        with open(path, "a"):
+            pass
+    except OSError:
+        pass
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_stale():
+    now = time.time()
+    for name in os.listdir(INFLIGHT_DIR):
+        path = os.path.join(INFLIGHT_DIR, name)
+        try:
+            if name.endswith(".pkl") and now - os.path.getmtime(path) > RESULT_TTL:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _unwrap(ok, value):
+    if not ok:
+        status_code, detail = value
+        raise HTTPException(status_code=status_code, detail=detail)
+    return value
+
+
+async def _run_across_workers(key, call):
+    os.makedirs(INFLIGHT_DIR, exist_ok=True)
+    lock_path = os.path.join(INFLIGHT_DIR, f"{key}.lock")
+    result_path = os.path.join(INFLIGHT_DIR, f"{key}.pkl")
+    waiting_path = os.path.join(INFLIGHT_DIR, f"{key}.waiting")
+
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+    try:
+        waited_from = None
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                # another worker computes the same thing, poll without blocking the loop
+                if waited_from is None:
+                    waited_from = time.time()
+                _touch(waiting_path)
+                if time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(POLL_SECONDS)
+
+        # waiters from now on touch the marker again
+        _remove(waiting_path)
+
+        if waited_from is not None:
+            shared = _read_result(result_path, waited_from)
+            if shared is not None:
+                _stats["shared_across_workers"] += 1
+                return _unwrap(*shared)
+
+        _stats["leaders"] += 1
+        try:
+            result = await call()
+        except HTTPException as e:
+            if os.path.exists(waiting_path):
+                _write_result(result_path, False, (e.status_code, e.detail))
+            raise
+        # nobody waits (the usual case): no pickle, no disk write
+        if os.path.exists(waiting_path):
+            _write_result(result_path, True, result)
+            _remove_stale()
+        return result
+    finally:
+        # closing the descriptor releases the lock
+        os.close(fd)
+
+
+def single_flight(fn):
+    """Coalesce concurrent identical calls of fn, sync functions run on a thread and become async."""
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        key = _key(fn, args, kwargs)
+
+        future = _inflight.get(key)
+        if future is not None:
+            _stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        if inspect.iscoroutinefunction(fn):
+            call = functools.partial(fn, *args, **kwargs)
+        else:
+            call = functools.partial(asyncio.to_thread, fn, *args, **kwargs)
+
+        future = asyncio.get_running_loop().create_future()
+        # nobody may be waiting, don't warn about an unretrieved exception
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        _inflight[key] = future
+        try:
+            result = await _run_across_workers(key, call)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+        finally:
+            del _inflight[key]
+
+        future.set_result(result)
+        return result
+
+    return wrapper
+
+
+def metrics():
+    return {"in_flight": len(_inflight), **_stats}
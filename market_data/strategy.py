@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+from market_data.executor import run_cpu
+from market_data.pricing import bs_greeks, GREEKS, IV_OK
+from market_data.response import negotiate, encode_series, arrow_response, json_response, ARROW, NDJSON
+from market_data.singleflight import single_flight
+from market_data.tables import RISK_FREE_RATE, parse_multi_iv_request, fetch_multi_iv_frames
+from market_data.timestamps import validate_ts_format
+from market_data.paging import with_cursor
+
+
+# Multi-leg strategy (spread, straddle, ...) as one series.
+#
+# The legs are the /multi-iv legs (one OPRA request for all of them, stored IV, see
+# iv_store). Every leg trade is a point of the common timeline, each leg contributes its
+# last trade and its last solved IV as of that point:
+#
+#   net_premium  sum(quantity * last price), per share: > 0 net debit, < 0 net credit
+#   greeks       sum(quantity * greek), every leg at its last solved IV and the current
+#                underlying price
+#
+# The timeline starts once every leg has traded in the range.
+
+STRATEGY_MAX_LEGS = 8
+
+YEAR_SECONDS = 3600 * 24 * 365.25
+
+
+def as_of(timeline, df, column):
+    # last value of `column` at or before every point of the timeline
+    return pd.merge_asof(timeline, df[["ts_event", column]], on="ts_event", direction="backward")[column].to_numpy(dtype=float)
+
+
+def build_strategy_frame(df_underlying, leg_frames, legs):
+    timeline = pd.concat([leg_frames[o["option_ticker"]][["ts_event"]] for o in legs], ignore_index=True)
+    timeline = timeline.drop_duplicates().sort_values("ts_event", kind="stable").reset_index(drop=True)
+
+    out = timeline.copy()
+    out["underlying_price"] = as_of(timeline, df_underlying.dropna(subset=["price"]), "price")
+    net_premium = np.zeros(len(out))
+    net_greeks = {greek: np.zeros(len(out)) for greek in GREEKS}
+
+    for n, o in enumerate(legs, 1):
+        df = leg_frames[o["option_ticker"]]
+        price = as_of(timeline, df, "price")
+        iv = as_of(timeline, df[df["iv_status"] == IV_OK], "iv")
+        years = ((pd.Timestamp(o["expiration_date"]) - timeline["ts_event"]).dt.total_seconds() / YEAR_SECONDS).to_numpy()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            greeks = bs_greeks(o["type"].lower(), out["underlying_price"].to_numpy(), o["strike_price"], years, RISK_FREE_RATE, iv)
+
+        out[f"leg{n}_price"] = price
+        out[f"leg{n}_iv"] = iv
+        net_premium += o["quantity"] * price
+        for greek in GREEKS:
+            net_greeks[greek] += o["quantity"] * greeks[greek]
+
+    out["net_premium"] = net_premium
+    for greek in GREEKS:
+        out[greek] = net_greeks[greek]
+
+    return out[~np.isnan(net_premium)].reset_index(drop=True)
+
+
+def build_strategy(df_underlying, leg_frames, legs, ts_format, fmt):
+    strategy = build_strategy_frame(df_underlying, leg_frames, legs)
+
+    meta = {"legs": [{"contract": o["trace_name"], "option_ticker": o["option_ticker"], "quantity": o["quantity"]} for o in legs]}
+    series = {"strategy": strategy, **{o["trace_name"]: leg_frames[o["option_ticker"]] for o in legs}}
+
+    if fmt == ARROW:
+        return arrow_response(meta, series)
+
+    # greeks of a leg without a solved IV yet are NaN, null in JSON
+    strategy = strategy.astype({col: object for col in strategy.columns if col != "ts_event"})
+    strategy = strategy.where(strategy.notna(), None)
+
+    return json_response({
+        **meta,
+        "strategy": encode_series(strategy, fmt, ts_format),
+        "options": [{"contract": o["trace_name"], "data": encode_series(leg_frames[o["option_ticker"]], fmt, ts_format)} for o in legs],
+    }, fmt)
+
+
+@single_flight
+async def fetch_strategy(legs, start_date, end_date, ts_format="str", accept=None, greeks=False, cursor=None):
+    ts_format = validate_ts_format(ts_format)
+    fmt = negotiate(accept)
+    if fmt == NDJSON:
+        raise HTTPException(status_code=406, detail="NDJSON is not available for strategies.")
+
+    if not legs:
+        raise HTTPException(status_code=400, detail="At least one leg is required.")
+    if len(legs) > STRATEGY_MAX_LEGS:
+        raise HTTPException(status_code=400, detail=f"At most {STRATEGY_MAX_LEGS} legs.")
+    if any(quantity == 0 for _, quantity in legs):
+        raise HTTPException(status_code=400, detail="Leg quantity must not be 0.")
+
+    underlying_ticker, option_tickers_parsed, start_date, end_date, next_cursor = parse_multi_iv_request(
+        [contract for contract, _ in legs], start_date, end_date, cursor, endpoint="strategy")
+
+    if len({o["option_ticker"] for o in option_tickers_parsed}) < len(option_tickers_parsed):
+        raise HTTPException(status_code=400, detail="Every contract can only be one leg.")
+    if len({o["underlying_ticker"] for o in option_tickers_parsed}) > 1:
+        raise HTTPException(status_code=400, detail="All legs must have the same underlying.")
+
+    legs = [{**o, "quantity": quantity} for o, (_, quantity) in zip(option_tickers_parsed, legs)]
+
+    df_underlying, leg_frames = await fetch_multi_iv_frames(underlying_ticker, legs, start_date, end_date, greeks)
+
+    response = await run_cpu(build_strategy, df_underlying, leg_frames, legs, ts_format, fmt)
+    return with_cursor(response, next_cursor)
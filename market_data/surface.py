@@ -0,0 +1,147 @@
+import asyncio
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+from databento import SType
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from market_data import cache
+from market_data.chain_index import load_chain, filter_chain
+from market_data.client import fetch_errors
+from market_data.executor import run_cpu
+from market_data.pricing import implied_volatility, IV_OK
+from market_data.singleflight import single_flight
+from market_data.tables import RISK_FREE_RATE
+
+
+# Implied volatility surface of a whole chain at one point in time.
+#
+# The contracts come from the chain index, the quotes from ONE parent-symbol request
+# ({ticker}.OPT, cbbo-1s) over a short window before the timestamp, the last quote of every
+# contract in that window is its snapshot. Mid prices are solved in one vectorized IV call
+# and laid out as a strike x expiry grid. By default every cell holds the out-of-the-money
+# side (puts below the underlying price, calls above), like a usual smile.
+
+SURFACE_MAX_WINDOW = pd.Timedelta(minutes=15)
+SURFACE_TYPES = ("otm", "C", "P")
+
+YEAR_SECONDS = 3600 * 24 * 365.25
+
+
+def last_quotes(df, symbol_col="symbol"):
+    # rows are in time order, keep the last valid two-sided quote per contract
+    df = df[(df["bid_px_00"] > 0) & (df["ask_px_00"] > 0) & (df["ask_px_00"] >= df["bid_px_00"])]
+    return df.groupby(symbol_col, sort=False).tail(1)
+
+
+def build_surface(chain, quotes, underlying_price, ts_ns, surface_type):
+    chain = chain.merge(
+        quotes[["symbol", "bid_px_00", "ask_px_00"]].rename(columns={"symbol": "raw_symbol"}),
+        on="raw_symbol",
+        how="inner",
+    )
+
+    if surface_type == "otm":
+        is_otm = np.where(chain["instrument_class"] == "C", chain["strike_price"] >= underlying_price, chain["strike_price"] < underlying_price)
+        chain = chain[is_otm]
+    else:
+        chain = chain[chain["instrument_class"] == surface_type]
+
+    # expiration is at 4pm New York time
+    expiration = pd.DatetimeIndex(pd.to_datetime(chain["expiration"]) + pd.Timedelta(hours=16)).tz_localize("America/New_York")
+    t = (expiration.as_unit("ns").asi8 - ts_ns) / 1e9 / YEAR_SECONDS
+
+    mid = ((chain["bid_px_00"] + chain["ask_px_00"]) / 2).to_numpy()
+    iv, iv_status = implied_volatility(mid, underlying_price, chain["strike_price"].to_numpy(), t, RISK_FREE_RATE, chain["instrument_class"].to_numpy())
+
+    points = chain.assign(iv=np.where(iv_status == IV_OK, iv, np.nan))
+    grid = points.pivot_table(index="strike_price", columns="expiration", values="iv", aggfunc="first", dropna=False)
+
+    values = np.round(grid.to_numpy(dtype=float), 6)
+    return JSONResponse(content={
+        "underlying_price": underlying_price,
+        "strikes": grid.index.tolist(),
+        "expirations": grid.columns.tolist(),
+        # rows: strikes, columns: expirations, null where there is no quote or no solution
+        "iv": np.where(np.isfinite(values), values, None).tolist(),
+        "contracts": int(len(chain)),
+        "solved": int((iv_status == IV_OK).sum()),
+    })
+
+
+@single_flight
+async def fetch_iv_surface(ticker, timestamp, window_seconds=60, surface_type="otm", min_moneyness=None, max_moneyness=None,
+                           min_expiration=None, max_expiration=None):
+    ticker = ticker.upper()
+    surface_type = "otm" if surface_type.lower() == "otm" else surface_type.upper()
+    if surface_type not in SURFACE_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid type. Use otm, C or P.")
+
+    try:
+        # New York wall time, as the chart endpoints
+        end = datetime.strptime(timestamp, "%Y-%m-%d %H:%M").replace(tzinfo=ZoneInfo("America/New_York"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid timestamp format. Use YYYY-MM-DD HH:MM.")
+    end = pd.Timestamp(end).tz_convert("UTC")
+
+    try:
+        for value in (min_expiration, max_expiration):
+            if value is not None:
+                datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid expiration format. Use YYYY-MM-DD.")
+
+    window = pd.Timedelta(seconds=window_seconds)
+    if window <= pd.Timedelta(0) or window > SURFACE_MAX_WINDOW:
+        raise HTTPException(status_code=400, detail="Window must be between 1 second and 15 minutes.")
+    start = end - window
+
+    day = pd.Timestamp(end.tz_convert("America/New_York").date())
+
+    with fetch_errors():
+        chain, df_underlying, df_quotes = await asyncio.gather(
+            asyncio.to_thread(load_chain, ticker, day),
+            cache.get_range_async(
+                dataset="XNAS.ITCH",
+                schema="bbo-1s",
+                symbols=ticker,
+                start=start,
+                end=end,
+            ),
+            # every contract of the chain in one request
+            cache.get_range_async(
+                dataset="OPRA.PILLAR",
+                schema="cbbo-1s",
+                symbols=f"{ticker}.OPT",
+                stype_in=SType.PARENT,
+                start=start,
+                end=end,
+            ),
+        )
+
+    underlying = last_quotes(df_underlying)
+    if underlying.empty:
+        raise HTTPException(status_code=404, detail="No underlying quote in the window.")
+    underlying_price = float((underlying["bid_px_00"].iloc[-1] + underlying["ask_px_00"].iloc[-1]) / 2)
+
+    chain = filter_chain(chain, min_moneyness=min_moneyness, max_moneyness=max_moneyness, underlying_price=underlying_price)
+    expiration = chain["expiration"]
+    # expiries that ended before the timestamp have no time value left
+    keep = expiration.to_numpy() >= day.strftime("%Y-%m-%d")
+    if min_expiration is not None:
+        keep &= expiration.to_numpy() >= min_expiration
+    if max_expiration is not None:
+        keep &= expiration.to_numpy() <= max_expiration
+    chain = chain[keep]
+
+    return await run_cpu(
+        build_surface,
+        chain,
+        last_quotes(df_quotes[["symbol", "bid_px_00", "ask_px_00"]]),
+        underlying_price,
+        end.value,
+        surface_type,
+    )
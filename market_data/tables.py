@@ -1,17 +1,36 @@
-from databento import Historical, SType
+import json
+import re
 from datetime import datetime
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
 import pandas as pd 
-from py_vollib.black_scholes.implied_volatility import implied_volatility
 from scipy.optimize import brentq, minimize_scalar
-import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file at project root
-load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
-DATABENTO_API_KEY = os.getenv("DATABENTO_API_KEY")
+import asyncio
+from market_data import cache, iv_store
+from market_data.client import fetch_errors
+from market_data.executor import run_cpu
+from market_data.singleflight import single_flight
+from market_data.pricing import implied_volatility, bs_greeks, GREEKS, IV_OK
+from market_data.timestamps import format_ts, format_num, validate_ts_format, NY_TZ
+from market_data.response import negotiate, encode_series, arrow_response, json_response, json_stream_response, series_record_items, series_column_items, ndjson_lines, ndjson_meta, ndjson_response, ARROW, COLUMNAR, NDJSON, NDJSON_CHUNK_ROWS
+from market_data.downsample import downsample_minmax, downsample_lttb, validate_max_points
+from market_data.paging import request_key, page_window, with_cursor
+
+RISK_FREE_RATE = 0.04
+
+_NY_ZONE = ZoneInfo(NY_TZ)
+
+# raw ticks are capped at 30 minutes, with server-side downsampling a full
+# extended session (04:00 - 20:00 ET) fits in a bounded response
+HF_MAX_RANGE = pd.Timedelta(minutes=30)
+HF_MAX_RANGE_DOWNSAMPLED = pd.Timedelta(hours=16)
+
+# longer ranges are paged (see market_data.paging): bars per /equity-chart page,
+# days per /multi-iv page, /opt-nbbo-hf pages are the two ranges above
+MAX_INTERVALS = 10_000
+MULTI_IV_PAGE = pd.Timedelta(days=5)
 
 # calculate chart settings (ranges of the axis)
 def solve_minx(x_anchor, y_anchor, x_max, y_min, y_max):
@@ -51,7 +70,20 @@ def find_solution(x_anchor, y_anchor, x_max, y_min, target=0.75):
         r, min_x = ratio(y_max, x_anchor, y_anchor, x_max, y_min)
         return min_x, y_max, r
 
-def date_and_interval_validation(startDate, endDate, interval):
+# native Databento bar sizes, derived intervals (5m, 15m, 4h, ...) are resampled from them
+UNIT_SECONDS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+RESAMPLE_RULES = {"d": "D", "h": "h", "m": "min", "s": "s"}
+MAX_BASE_BARS = 2_000_000
+
+def parse_interval(interval):
+    # "m" / "1m" -> (1, "m"), "15M" -> (15, "m"), "4h" -> (4, "h")
+    interval = interval.strip().lower()
+    multiple, unit = interval[:-1], interval[-1:]
+    if unit not in UNIT_SECONDS or not (multiple == "" or multiple.isdigit()) or multiple.startswith("0"):
+        raise HTTPException(status_code=400, detail="Invalid interval. Use D, H, M or S, optionally with a multiple such as 5M or 4H.")
+    return int(multiple or 1), unit
+
+def date_and_interval_validation(startDate, endDate, interval, max_intervals=MAX_INTERVALS):
     # validate dates and interval
     try:
         start_date = datetime.strptime(startDate, "%Y-%m-%d %H:%M")
@@ -67,9 +99,7 @@ def date_and_interval_validation(startDate, endDate, interval):
     if start_date >= end_date:
         raise HTTPException(status_code=400, detail="Start date must be before end date.")
     
-    interval = interval.lower()
-    if interval not in ["d", "h", "m", "s"]:
-        raise HTTPException(status_code=400, detail="Invalid interval. Use D, H, M, or S.")
+    multiple, unit = parse_interval(interval)
     
     # start / end date must be in UTC, but user input is in New York time
     nyc_tz = ZoneInfo("America/New_York")
@@ -83,22 +113,55 @@ def date_and_interval_validation(startDate, endDate, interval):
     
     # check how many intervals are in the range
     delta = end_date - start_date
-    if interval == "d":
+    if unit == "d":
         num_intervals = delta.days
-    elif interval == "h":
+    elif unit == "h":
         num_intervals = delta.days * 24 + delta.seconds // 3600
-    elif interval == "m":
+    elif unit == "m":
         num_intervals = delta.days * 24 * 60 + delta.seconds // 60
-    elif interval == "s":
+    elif unit == "s":
         num_intervals = delta.days * 24 * 60 * 60 + delta.seconds
-    if num_intervals > 10000:
+    # the limit is on output bars, a 15m chart may span 15x the range of a 1m chart
+    if max_intervals is not None and num_intervals // multiple > max_intervals:
         raise HTTPException(status_code=400, detail="Too many intervals. Limit is 10,000.")
     
-    return start_date, end_date, interval
+    return start_date, end_date, f"{multiple}{unit}"
+
+# OCC: root (6, space padded) | YYMMDD | C/P | strike dollars (5) | thousandths (3)
+OCC_PATTERN = r"^[A-Z0-9.]{1,6} *\d{6}[CP]\d{8}$"
+
+def decode_option_tickers(raw_symbols):
+    """
+    Bulk decode_option_ticker over a Series / array of OCC symbols, one row per input.
+
+    Columns: option_ticker, underlying_ticker, expiration_date (4pm New York),
+    strike_price, type and valid. Symbols that are not OCC are kept with valid=False
+    and empty fields instead of raising.
+    """
+    raw = pd.Series(raw_symbols, dtype=object).astype(str).str.upper()
+    raw.index = range(len(raw))
+    valid = raw.str.len().eq(21) & raw.str.match(OCC_PATTERN)
+    occ = raw.where(valid, "      000101C00000000")
+
+    expiration_date = pd.to_datetime("20" + occ.str[6:12], format="%Y%m%d", errors="coerce")
+    valid &= expiration_date.notna()
+    expiration_date = (expiration_date + pd.Timedelta(hours=16)).dt.tz_localize(NY_TZ)
+    strike_price = occ.str[13:18].astype("int64") + occ.str[18:21].astype("int64") / 1000
+
+    return pd.DataFrame({
+        "option_ticker": raw,
+        "underlying_ticker": occ.str[:6].str.strip().where(valid),
+        "expiration_date": expiration_date.where(valid),
+        "strike_price": strike_price.where(valid),
+        "type": occ.str[12].where(valid),
+        "valid": valid.to_numpy(),
+    })
+
+@lru_cache(maxsize=4096)
+def _decode_option_ticker(option_ticker):
+    if len(option_ticker) != 21 or not re.match(OCC_PATTERN, option_ticker):
+        raise HTTPException(status_code=400, detail="Invalid option ticker. Use the 21 character OCC symbol.")
 
-def decode_option_ticker(option_ticker): 
-    option_ticker = option_ticker.upper()
-    
     underlying_ticker = option_ticker[:6].strip()
 
     y = option_ticker[6:8]
@@ -111,16 +174,166 @@ def decode_option_ticker(option_ticker):
     # construct date object 
     expiration_date = f"20{y}-{m}-{d} 16:00:00" # expiration is at 4pm eastern time
     # ensure date is in eastern time
-    expiration_date = datetime.strptime(expiration_date, "%Y-%m-%d %H:%M:%S").replace(tzinfo=ZoneInfo("America/New_York"))
+    try:
+        expiration_date = datetime.strptime(expiration_date, "%Y-%m-%d %H:%M:%S").replace(tzinfo=_NY_ZONE)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid option ticker. Use the 21 character OCC symbol.")
     
     # strike price 
     strike_price = int(dollars) + int(cents) / 1000
     
     return option_ticker, underlying_ticker, expiration_date, strike_price, t
 
-def fetch_multi_iv(raw_opt_tickers, start_date, end_date): 
-    client = Historical(DATABENTO_API_KEY) 
+def decode_option_ticker(option_ticker): 
+    # memoized, every leg and live feed of a contract decodes the same symbol again
+    return _decode_option_ticker(option_ticker.upper())
 
+def solve_iv(df, expiration_date, strike_price, t, price_col="price_x", underlying_col="price_y", greeks=False):
+    # drop rows without a match, then solve IV for the whole frame at once
+    df = df.dropna(subset=[price_col, underlying_col])
+    
+    years_until_expiration = (pd.Timestamp(expiration_date) - df["ts_event"]).dt.total_seconds() / (3600 * 24 * 365.25)
+    
+    iv, iv_status = implied_volatility(
+        df[price_col].to_numpy(),
+        df[underlying_col].to_numpy(),
+        strike_price,
+        years_until_expiration.to_numpy(),
+        RISK_FREE_RATE,
+        t.lower())
+    
+    if not greeks:
+        return df.assign(iv=iv, iv_status=iv_status)
+    
+    # same arrays, solved IV as sigma (NaN where unsolved)
+    return df.assign(iv=iv, iv_status=iv_status, **bs_greeks(
+        t.lower(),
+        df[underlying_col].to_numpy(),
+        strike_price,
+        years_until_expiration.to_numpy(),
+        RISK_FREE_RATE,
+        iv))
+
+def trade_frame(df, price_col="price", size_col="size"):
+    return df[["ts_event", price_col, size_col]].rename(columns={price_col: "price", size_col: "size"}).reset_index(drop=True)
+
+def book_frame(df, side):
+    df = df[df[f"{side}_px_00"].notna()]
+    return trade_frame(df, f"{side}_px_00", f"{side}_sz_00")
+
+def iv_frame(df):
+    # merged option/underlying trades with solved IV (and greeks if asked for) -> response columns
+    greek_columns = [col for col in GREEKS if col in df.columns]
+    return df[["ts_event", "price_x", "size_x", "price_y", "iv", "iv_status", *greek_columns]].rename(columns={
+        "price_x": "price",
+        "size_x": "size",
+        "price_y": "underlying_price",
+    }).reset_index(drop=True)
+
+IV_SOURCES = ("trades", "quotes")
+
+def quote_mid_frame(df, mid_col):
+    # two-sided quotes only, sorted for the as-of join
+    df = df[(df["bid_px_00"] > 0) & (df["ask_px_00"] > 0) & (df["ask_px_00"] >= df["bid_px_00"])]
+    out = df[["ts_event"]].reset_index(drop=True)
+    out[mid_col] = (df["bid_px_00"].to_numpy() + df["ask_px_00"].to_numpy()) / 2
+    return out.sort_values("ts_event", kind="stable")
+
+def mid_changes(df, mid_col, last=None):
+    # two-sided mids that differ from the one before, `last` is the mid the previous chunk ended on
+    mids = quote_mid_frame(df, mid_col)
+    previous = mids[mid_col].shift()
+    if last is not None and len(mids) > 0:
+        previous.iloc[0] = last
+    return mids[mids[mid_col].ne(previous).to_numpy()], (mids[mid_col].iloc[-1] if len(mids) > 0 else last)
+
+def solve_mid_iv(option, underlying_mids, expiration_date, strike_price, t, greeks=False):
+    # IV of every option NBBO mid change against the underlying mid prevailing at that moment
+    df = pd.merge_asof(
+        option,
+        underlying_mids,
+        on='ts_event',
+        direction='backward'
+    )
+    
+    return solve_iv(df, expiration_date, strike_price, t, price_col="mid", underlying_col="underlying_mid", greeks=greeks).reset_index(drop=True)
+
+def solve_quote_iv(df_option, df_underlying, expiration_date, strike_price, t, greeks=False):
+    option, _ = mid_changes(df_option, "mid")
+    return solve_mid_iv(option, quote_mid_frame(df_underlying, "underlying_mid"), expiration_date, strike_price, t, greeks)
+
+# columns the builders need, everything else stays out of the process pool pickle
+TRADE_COLUMNS = ["ts_event", "price", "size"]
+MBP_COLUMNS = ["ts_event", "action", "price", "size", "bid_px_00", "ask_px_00", "bid_sz_00", "ask_sz_00"]
+# Databento's dtypes, an empty range has to stack with real ones (Arrow)
+MBP_DTYPES = {"ts_event": "datetime64[ns, UTC]", "action": object, "price": float, "size": "uint32",
+              "bid_px_00": float, "ask_px_00": float, "bid_sz_00": "uint32", "ask_sz_00": "uint32"}
+OHLCV_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+def book_changes(df):
+    # trades, plus the book updates that move the top of book (bid, ask or their sizes)
+    book = df[["bid_px_00", "ask_px_00", "bid_sz_00", "ask_sz_00"]]
+    changed = book.ne(book.shift()).any(axis=1).to_numpy()
+    return df[changed | (df["action"] == "T").to_numpy()]
+
+def empty_mbp():
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in MBP_DTYPES.items()})
+
+def load_mbp(dataset, schema, symbol, start_date, end_date, max_points=None):
+    # read chunk by chunk: only the builder's columns, and for downsampled charts only
+    # the rows that can change a point, are ever held for the whole range
+    frames = []
+    for chunk in cache.iter_range(dataset=dataset, schema=schema, symbols=symbol, start=start_date, end=end_date, columns=MBP_COLUMNS):
+        frames.append(book_changes(chunk) if max_points is not None else chunk)
+    if not frames:
+        return empty_mbp()
+    return pd.concat(frames, ignore_index=True)
+
+def merge_leg(df_underlying, df_option):
+    return pd.merge_asof(
+        df_option,
+        df_underlying,
+        on='ts_event',
+        direction='nearest'
+    )
+
+def solve_leg(df3, option_ticker_dict, greeks=False):
+    df3 = solve_iv(df3, option_ticker_dict["expiration_date"], option_ticker_dict["strike_price"], option_ticker_dict["type"], greeks=greeks)
+
+    return iv_frame(df3)
+
+def solve_legs(df_underlying, option_frames, option_tickers_parsed):
+    # greeks included, the legs are stored once for every request (see iv_store)
+    return {
+        o["option_ticker"]: solve_leg(merge_leg(df_underlying, option_frames[o["option_ticker"]]), o, greeks=True)
+        for o in option_tickers_parsed
+    }
+
+def without_greeks(df, greeks):
+    return df if greeks else df.drop(columns=list(GREEKS), errors="ignore")
+
+def build_multi_iv(df_underlying, leg_frames, option_tickers_parsed, ts_format, fmt):
+    series = {"underlying": trade_frame(df_underlying)}
+
+    for option_ticker_dict in option_tickers_parsed:
+        series[option_ticker_dict['trace_name']] = leg_frames[option_ticker_dict["option_ticker"]]
+
+    if fmt == ARROW:
+        return arrow_response({"contracts": [o["trace_name"] for o in option_tickers_parsed]}, series)
+
+    full_data = {"options": [], "underlying": encode_series(series.pop("underlying"), fmt, ts_format)}
+    for contract, df in series.items():
+        full_data["options"].append({"contract": contract, "data": encode_series(df, fmt, ts_format)})
+
+    return json_response(full_data, fmt)
+
+def build_multi_iv_leg_lines(df_iv, option_ticker_dict, ts_format):
+    return ndjson_lines(option_ticker_dict["trace_name"], df_iv, ts_format)
+
+def build_underlying_lines(df_underlying, ts_format):
+    return ndjson_lines("underlying", trade_frame(df_underlying), ts_format)
+
+def parse_multi_iv_request(raw_opt_tickers, start_date, end_date, cursor=None, endpoint="multi-iv"):
     underlying_ticker = ""
     option_tickers_parsed = []
 
@@ -151,250 +364,182 @@ def fetch_multi_iv(raw_opt_tickers, start_date, end_date):
     end_date = end_date.replace(tzinfo=nyc_tz)
     end_date = end_date.astimezone(utc_tz)
 
-    # max 5 days
-    if end_date - start_date > pd.Timedelta(days=5):
-        raise HTTPException(status_code=400, detail="Maximum range is 30 minutes.")
-    
-    df_underlying = client.timeseries.get_range(
+    if start_date >= end_date:
+        raise HTTPException(status_code=400, detail="Start date must be before end date.")
+
+    # 5 days per page
+    key = request_key(endpoint, [o["option_ticker"] for o in option_tickers_parsed], start_date, end_date)
+    start_date, end_date, next_cursor = page_window(start_date, end_date, MULTI_IV_PAGE, key, cursor)
+
+    return underlying_ticker, option_tickers_parsed, start_date, end_date, next_cursor
+
+def load_multi_iv_underlying(underlying_ticker, start_date, end_date):
+    # a task, so the option legs can download while it loads
+    return asyncio.ensure_future(cache.get_range_async(
         dataset="XNAS.ITCH",
         schema=f"trades",
         symbols=underlying_ticker,
         start=start_date,
         end=end_date,
-    ).to_df()
+        columns=TRADE_COLUMNS,
+    ))
+
+def load_multi_iv_options(symbols, gap_start, gap_end):
+    # option trades of a missing range, one multi-symbol OPRA request for all legs missing it
+    return cache.get_range_multi_async(
+        dataset="OPRA.PILLAR",
+        schema="trades",
+        symbols=symbols,
+        start=gap_start,
+        end=gap_end,
+        columns=TRADE_COLUMNS,
+    )
 
-    full_data = {"options": [], "underlying": []}
+def multi_iv_solver(underlying, option_tickers_parsed, loaded=None):
+    # iv_store compute of the legs: option trades of a missing range merged with the
+    # underlying and solved. `loaded` holds option trades fetched already, by gap
+    legs = {o["option_ticker"]: o for o in option_tickers_parsed}
+    loaded = loaded or {}
+
+    async def solve_gap(gap_start, gap_end, symbols):
+        if (gap_start, gap_end) in loaded:
+            option_frames = loaded[(gap_start, gap_end)]
+        else:
+            option_frames = await load_multi_iv_options(symbols, gap_start, gap_end)
+        df_underlying = (await underlying)[TRADE_COLUMNS]
+        return await run_cpu(
+            solve_legs,
+            df_underlying,
+            {symbol: option_frames[symbol][TRADE_COLUMNS] for symbol in symbols},
+            [legs[symbol] for symbol in symbols],
+        )
 
-    for row in df_underlying.itertuples():
-        row_date = row.ts_event # in UTC
-        row_date = row_date.replace(tzinfo=ZoneInfo("UTC"))
-        
-        # convert to eastern time
-        row_date = row_date.astimezone(ZoneInfo("America/New_York"))
-        row_date_str = row_date.strftime("%Y-%m-%d %H:%M:%S.%f")
-
-        full_data["underlying"].append({
-            "ts_event": row_date_str,
-            "price": row.price,
-            "size": row.size,
-        })
-    
+    return solve_gap
 
-    for option_ticker_dict in option_tickers_parsed:
-        option_ticker = option_ticker_dict["option_ticker"]
-
-        df_option = client.timeseries.get_range(
-            dataset="OPRA.PILLAR",
-            schema="trades",
-            symbols=option_ticker,
-            start=start_date,
-            end=end_date).to_df()
-        
-        df3 = pd.merge_asof(
-            df_option,
-            df_underlying,
-            on='ts_event',
-            direction='nearest'
+def multi_iv_names(option_tickers):
+    return {ticker: iv_store.series_name("trades", RISK_FREE_RATE) for ticker in option_tickers}
+
+async def multi_iv_legs(option_tickers, start_date, end_date, solve_gap, greeks=False, gaps=None):
+    # stored legs are read back, only the missing ranges are solved
+    leg_frames = await iv_store.cached_series(multi_iv_names(option_tickers), start_date, end_date, solve_gap, gaps)
+    return {ticker: without_greeks(df, greeks) for ticker, df in leg_frames.items()}
+
+async def fetch_multi_iv_frames(underlying_ticker, option_tickers_parsed, start_date, end_date, greeks=False):
+    # underlying trades and the IV of every leg, all legs at once
+    underlying = load_multi_iv_underlying(underlying_ticker, start_date, end_date)
+    try:
+        leg_frames = await multi_iv_legs(
+            [o["option_ticker"] for o in option_tickers_parsed],
+            start_date,
+            end_date,
+            multi_iv_solver(underlying, option_tickers_parsed),
+            greeks,
         )
+        df_underlying = await underlying
+    finally:
+        if not underlying.done():
+            underlying.cancel()
+
+    return df_underlying[TRADE_COLUMNS], leg_frames
+
+@single_flight
+async def buffered_multi_iv(raw_opt_tickers, start_date, end_date, ts_format, fmt, greeks, cursor=None):
+    underlying_ticker, option_tickers_parsed, start_date, end_date, next_cursor = parse_multi_iv_request(raw_opt_tickers, start_date, end_date, cursor)
+
+    df_underlying, leg_frames = await fetch_multi_iv_frames(underlying_ticker, option_tickers_parsed, start_date, end_date, greeks)
+
+    response = await run_cpu(
+        build_multi_iv,
+        df_underlying,
+        leg_frames,
+        option_tickers_parsed,
+        ts_format,
+        fmt,
+    )
+    return with_cursor(response, next_cursor)
 
-        
-        opt_pricing_data = []
-
-        for row in df3.itertuples():
-            row_date = row.ts_event
-            row_date = row_date.replace(tzinfo=ZoneInfo("UTC"))
-            row_date = row_date.astimezone(ZoneInfo("America/New_York"))
-            
-            # include milliseconds
-            row_date_str = row_date.strftime("%Y-%m-%d %H:%M:%S.%f")
-            
-            expiration_date = option_ticker_dict["expiration_date"]
-            hours_until_expiration = (expiration_date - row_date).total_seconds() / 3600
-            
-            years_until_expiration = hours_until_expiration / (24 * 365.25) 
-            
-            if pd.isna(row.price_x) or pd.isna(row.price_y):
-                continue
-                
-            try:
-                iv = implied_volatility(
-                    row.price_x,
-                    row.price_y,
-                    option_ticker_dict["strike_price"],
-                    years_until_expiration,
-                    0.04,
-                    option_ticker_dict['type'].lower())
-            except Exception as e:
-                iv = 0
-
-            opt_pricing_data.append({
-                                "ts_event": row_date_str,
-                                "price": row.price_x,
-                                "size": row.size_x,
-                                "underlying_price": row.price_y,
-                                "iv": iv})
-
-        full_data["options"].append({"contract": option_ticker_dict['trace_name'], "data": opt_pricing_data})
-
-    return full_data
+async def stream_multi_iv(raw_opt_tickers, start_date, end_date, ts_format, greeks, cursor=None):
+    underlying_ticker, option_tickers_parsed, start_date, end_date, next_cursor = parse_multi_iv_request(raw_opt_tickers, start_date, end_date, cursor)
 
+    option_tickers = [o["option_ticker"] for o in option_tickers_parsed]
+    underlying = load_multi_iv_underlying(underlying_ticker, start_date, end_date)
+    try:
+        # the missing option trades of all legs up front, one request per missing range:
+        # settled ranges into the cache, the unsettled tail (never cached) kept here
+        gaps = await iv_store.series_gaps(multi_iv_names(option_tickers), start_date, end_date)
+        await asyncio.gather(*(
+            asyncio.to_thread(cache.prefetch, dataset="OPRA.PILLAR", schema="trades", symbols=symbols, start=gap_start, end=gap_end)
+            for (gap_start, gap_end, storable), symbols in gaps.items() if storable
+        ))
+        loaded = {
+            (gap_start, gap_end): await load_multi_iv_options(symbols, gap_start, gap_end)
+            for (gap_start, gap_end, storable), symbols in gaps.items() if not storable
+        }
+        df_underlying = (await underlying)[TRADE_COLUMNS]
+    finally:
+        if not underlying.done():
+            underlying.cancel()
+    solve_gap = multi_iv_solver(underlying, option_tickers_parsed, loaded)
+
+    # one process pool job per underlying chunk and per leg, only one encoded piece is held
+    # at a time. Legs are solved from the cache one after the other, each goes out as soon as it is there
+    async def lines():
+        yield ndjson_meta({"contracts": [o["trace_name"] for o in option_tickers_parsed]})
 
-# Opt. NBBO HF Underlying + IV
-def fetch_hf_iv(option_ticker, startDate, endDate): 
-    client = Historical(DATABENTO_API_KEY) 
-    
-    # get the underlying 
-    option_ticker, underlying_ticker, expiration_date, strike_price, t = decode_option_ticker(option_ticker)
-    
-    start_date, end_date, _ = date_and_interval_validation(startDate, endDate, "m")
-    
-    # max 30 minutes 
-    if end_date - start_date > pd.Timedelta(minutes=30):
-        raise HTTPException(status_code=400, detail="Maximum range is 30 minutes.")
-    
-    global_data = {
-        "expiration_date" : expiration_date.strftime("%Y-%m-%d %H:%M:%S"), 
-        "underlying_ticker": underlying_ticker,
-        "option_ticker": option_ticker, 
-        "strike_price": format(strike_price, ".2f")
-    }
+        try:
+            for start in range(0, max(len(df_underlying), 1), NDJSON_CHUNK_ROWS):
+                yield await run_cpu(build_underlying_lines, df_underlying.iloc[start:start + NDJSON_CHUNK_ROWS], ts_format)
 
-    try: 
-        df_underlying = client.timeseries.get_range(
-            dataset="XNAS.ITCH",
-            schema=f"mbp-1",
-            symbols=underlying_ticker,
-            start=start_date,
-            end=end_date,
-        ).to_df()
-        
-        df_option = client.timeseries.get_range(
-            dataset="OPRA.PILLAR",
-            schema=f"cmbp-1",
-            symbols=option_ticker,
-            start=start_date,
-            end=end_date,
-        ).to_df()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching data from Databento: {e}")
-        
-    # data
-    opt_bid = []
-    opt_ask = []
-    opt_trades = []
-    
-    und_bid = []
-    und_ask = []
-    und_trades = []
-    
-    opt_iv = []
-    
-    for row in df_underlying.itertuples():
-        row_date = row.ts_event # in UTC
-        row_date = row_date.replace(tzinfo=ZoneInfo("UTC"))
-        
-        # convert to eastern time
-        row_date = row_date.astimezone(ZoneInfo("America/New_York"))
-        row_date_str = row_date.strftime("%Y-%m-%d %H:%M:%S.%f")
-
-        if row.action == 'T' and pd.isna(row.price) == False:
-            und_trades.append({
-                "ts_event": row_date_str,
-                "price": row.price,
-                "size": row.size,
-            })
-        else: 
-            if pd.isna(row.bid_px_00) == False:
-                und_bid.append({
-                    "ts_event": row_date_str,
-                    "price": row.bid_px_00,
-                    "size": row.bid_sz_00,
-                })
-                
-            if pd.isna(row.ask_px_00) == False:
-                und_ask.append({
-                    "ts_event": row_date_str,
-                    "price": row.ask_px_00,
-                    "size": row.ask_sz_00,
-                })
-                
-    for row in df_option.itertuples():
-        row_date = row.ts_event
-        row_date = row_date.replace(tzinfo=ZoneInfo("UTC"))
-        
-        row_date = row_date.astimezone(ZoneInfo("America/New_York"))
-        row_date_str = row_date.strftime("%Y-%m-%d %H:%M:%S.%f")
-
-        if row.action == 'T':
-            continue
-        else: 
-            if pd.isna(row.bid_px_00) == False:
-                opt_bid.append({
-                    "ts_event": row_date_str,
-                    "price": row.bid_px_00,
-                    "size": row.bid_sz_00,
-                })
-
-            if pd.isna(row.ask_px_00) == False:
-                opt_ask.append({
-                    "ts_event": row_date_str,
-                    "price": row.ask_px_00,
-                    "size": row.ask_sz_00,
-                })
-            
-        
-    # select only trades
-    df_underlying_trades = df_underlying[df_underlying['action'] == 'T']
-    df_option_trades = df_option[df_option['action'] == 'T']
-        
+            for option_ticker_dict in option_tickers_parsed:
+                option_ticker = option_ticker_dict["option_ticker"]
+                leg = (await multi_iv_legs([option_ticker], start_date, end_date, solve_gap, greeks, gaps))[option_ticker]
+                yield await run_cpu(build_multi_iv_leg_lines, leg, option_ticker_dict, ts_format)
+        except HTTPException as e:
+            # the status line is already sent, report it in the stream
+            yield ndjson_meta({"error": e.detail})
+
+    return with_cursor(ndjson_response(lines()), next_cursor)
+
+async def fetch_multi_iv(raw_opt_tickers, start_date, end_date, ts_format="str", accept=None, greeks=False, cursor=None): 
+    ts_format = validate_ts_format(ts_format)
+    fmt = negotiate(accept)
+
+    if fmt == NDJSON:
+        return await stream_multi_iv(raw_opt_tickers, start_date, end_date, ts_format, greeks, cursor)
+
+    return await buffered_multi_iv(raw_opt_tickers, start_date, end_date, ts_format, fmt, greeks, cursor)
+
+
+def solve_trade_iv(df_underlying, df_option, expiration_date, strike_price, t):
+    # option trades vs the nearest underlying trade, greeks included (stored, see iv_store)
     df3 = pd.merge_asof(
-        df_option_trades,
-        df_underlying_trades,
+        df_option[df_option['action'] == 'T'],
+        df_underlying[df_underlying['action'] == 'T'],
         on='ts_event',
         direction='nearest'
     )
-        
-    for row in df3.itertuples():
-        row_date = row.ts_event
-        row_date = row_date.replace(tzinfo=ZoneInfo("UTC"))
-        row_date = row_date.astimezone(ZoneInfo("America/New_York"))
-        
-        # include milliseconds
-        row_date_str = row_date.strftime("%Y-%m-%d %H:%M:%S.%f")
-        
-        hours_until_expiration = (expiration_date - row_date).total_seconds() / 3600
-        
-        years_until_expiration = hours_until_expiration / (24 * 365.25) 
-        
-        if pd.isna(row.price_x) or pd.isna(row.price_y):
-            continue
-        
-        try:
-            iv = implied_volatility(
-                row.price_x,
-                row.price_y,
-                strike_price,
-                years_until_expiration,
-                0.04,
-                t.lower())
-        except Exception as e:
-            iv = 0
-        
-        opt_trades.append({"ts_event": row_date_str,
-                           "price": row.price_x,
-                           "size": row.size_x,
-                           "underlying_price": row.price_y,
-                           "iv": iv})
-        
-        opt_iv.append({"ts_event": row_date_str,
-                       "iv": iv})
-        
-    # calculate chart settings
+    return iv_frame(solve_iv(df3, expiration_date, strike_price, t, greeks=True))
+
+HF_SERIES = ("option_bid", "option_ask", "option_trades", "underlying_bid", "underlying_ask", "underlying_trades", "option_iv")
+HF_COLUMNS = ["ts_event", "price", "size"]
+
+def hf_global_data(option_ticker, underlying_ticker, expiration_date, strike_price, iv_source):
+    return {
+        "expiration_date" : expiration_date.strftime("%Y-%m-%d %H:%M:%S"), 
+        "underlying_ticker": underlying_ticker,
+        "option_ticker": option_ticker, 
+        "strike_price": format(strike_price, ".2f"),
+        "iv_source": iv_source,
+    }
+
+def hf_meta(global_data, df_iv, min_bid, max_ask):
+    # calculate chart settings, min_bid / max_ask are None without quotes
     min_iv = 0 # const 
-    max_iv = max([float(x['iv']) for x in opt_iv]) if len(opt_iv) > 0 else 1
+    solved_iv = df_iv.loc[df_iv["iv_status"] == IV_OK, "iv"]
+    max_iv = float(solved_iv.max()) if len(solved_iv) > 0 else 1
     
-    min_opt_price = min([float(x['price']) for x in opt_bid]) if len(opt_bid) > 0 else 0
-    max_opt_price = max([float(x['price']) for x in opt_ask]) * 1.1 if len(opt_ask) > 0 else 1
+    min_opt_price = min_bid if min_bid is not None else 0
+    max_opt_price = max_ask * 1.1 if max_ask is not None else 1
     
     chart_opt_price_min, chart_iv_max, r = find_solution(
         x_anchor = min_opt_price,
@@ -404,8 +549,7 @@ def fetch_hf_iv(option_ticker, startDate, endDate):
         target = 0.7
     )
     
-        
-    return JSONResponse(content={
+    return {
         "opt_chart_settings": { 
             "chart_opt_price_min": chart_opt_price_min, 
             "chart_opt_price_max": max_opt_price,
@@ -413,91 +557,398 @@ def fetch_hf_iv(option_ticker, startDate, endDate):
             "chart_iv_max": chart_iv_max,
         }, 
         "global_data": global_data,
-        "option_bid": opt_bid,
-        "option_ask": opt_ask,
-        "option_trades": opt_trades,
-        "underlying_bid": und_bid,
-        "underlying_ask": und_ask,
-        "underlying_trades": und_trades,
-        "option_iv": opt_iv
-    })
+    }
+
+def hf_book_series(df, name):
+    # one raw book series of an mbp-1 / cmbp-1 frame (or chunk)
+    side = name.split("_")[1]
+    if name.startswith("option"):
+        return book_frame(df[df['action'] != 'T'], side)
+    # underlying: trades with a price, everything else is a book update
+    und_trade_mask = (df['action'] == 'T') & df['price'].notna()
+    return trade_frame(df[und_trade_mask]) if side == "trades" else book_frame(df[~und_trade_mask], side)
+
+def hf_iv_frames(df_trade_iv, df_quote_iv, iv_source):
+    # option_trades, option_iv and the frame the chart settings come from
+    if iv_source == "quotes":
+        # trades keep their own IV, the IV series follows the book
+        return df_trade_iv, df_quote_iv.drop(columns=["mid", "underlying_mid"]), df_quote_iv
+    return df_trade_iv, df_trade_iv.drop(columns=["price", "size", "underlying_price"]), df_trade_iv
+
+def build_hf_iv(df_underlying, df_option, option_ticker, underlying_ticker, expiration_date, strike_price, t, ts_format, fmt, max_points, df_trade_iv, df_quote_iv=None, iv_source="trades"):
+    global_data = hf_global_data(option_ticker, underlying_ticker, expiration_date, strike_price, iv_source)
+    option_trades, option_iv, df_iv = hf_iv_frames(df_trade_iv, df_quote_iv, iv_source)
+
+    small = {"option_trades": option_trades, "option_iv": option_iv}
+    series = {
+        name: small[name] if name in small else hf_book_series(df_underlying if name.startswith("underlying") else df_option, name)
+        for name in HF_SERIES
+    }
     
+    if max_points is not None:
+        # prices keep every bucket's extremes, IV keeps its shape
+        series = {
+            name: downsample_lttb(df, max_points) if name == "option_iv" else downsample_minmax(df, max_points)
+            for name, df in series.items()
+        }
+        
+    meta = hf_meta(
+        global_data,
+        df_iv,
+        float(series["option_bid"]["price"].min()) if len(series["option_bid"]) > 0 else None,
+        float(series["option_ask"]["price"].max()) if len(series["option_ask"]) > 0 else None,
+    )
+    
+    if fmt == ARROW:
+        return arrow_response(meta, series)
+    
+    return json_response({**meta, **{name: encode_series(df, fmt, ts_format) for name, df in series.items()}}, fmt)
+
+def _between(df, start, end):
+    return df[(df["ts_event"] >= start) & (df["ts_event"] < end)]
+
+def load_mbp_trades(dataset, schema, symbol, start_date, end_date, lo=None, hi=None):
+    # trade rows only (with ts_event in [lo, hi)), filtered chunk by chunk
+    frames = []
+    for chunk in cache.iter_range(dataset=dataset, schema=schema, symbols=symbol, start=start_date, end=end_date, columns=MBP_COLUMNS):
+        chunk = chunk[chunk["action"] == "T"]
+        frames.append(chunk if lo is None else _between(chunk, lo, hi))
+    non_empty = [df for df in frames if not df.empty]
+    if not non_empty:
+        return empty_mbp()
+    return pd.concat(non_empty, ignore_index=True)
+
+def load_mid_changes(dataset, schema, symbol, start_date, end_date, mid_col, lo=None, hi=None):
+    # mid changes only (with ts_event in [lo, hi)), the last mid carries over to the next chunk
+    frames = []
+    last = None
+    for chunk in cache.iter_range(dataset=dataset, schema=schema, symbols=symbol, start=start_date, end=end_date, columns=MBP_COLUMNS):
+        if lo is not None:
+            chunk = _between(chunk, lo, hi)
+        changes, last = mid_changes(chunk, mid_col, last)
+        frames.append(changes)
+    non_empty = [df for df in frames if not df.empty]
+    if not non_empty:
+        return pd.DataFrame({"ts_event": pd.Series(dtype="datetime64[ns, UTC]"), mid_col: pd.Series(dtype=float)})
+    return pd.concat(non_empty, ignore_index=True)
+
+def hf_items(df, ts_format, column=None):
+    return series_record_items(df, ts_format) if column is None else series_column_items(df, column, ts_format)
+
+def hf_encoded_chunks(dataset, schema, symbol, start_date, end_date, name, ts_format, column=None):
+    # encoded items of one book series chunk by chunk, with the chunk's price range
+    for chunk in cache.iter_range(dataset=dataset, schema=schema, symbols=symbol, start=start_date, end=end_date, columns=MBP_COLUMNS):
+        df = hf_book_series(chunk, name)
+        if len(df) > 0:
+            yield hf_items(df, ts_format, column), (float(df["price"].min()), float(df["price"].max()))
+
+async def thread_iter(gen):
+    # drive a blocking generator (cache reads) from a thread, one item at a time
+    done = object()
+    try:
+        while True:
+            item = await asyncio.to_thread(next, gen, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        gen.close()
+
+async def hf_iv_series(option_ticker, start_date, end_date, greeks, iv_source, solve_trades, solve_quotes):
+    # stored IV series, only the missing ranges are solved. Both are the same with and
+    # without maxPoints: the downsampled books keep every trade and every quote change
+    names = {option_ticker: iv_store.series_name("mbp-trades", RISK_FREE_RATE)}
+    df_trade_iv = without_greeks((await iv_store.cached_series(names, start_date, end_date, solve_trades))[option_ticker], greeks)
+    df_quote_iv = None
+    if iv_source == "quotes":
+        names = {option_ticker: iv_store.series_name("mbp-quotes", RISK_FREE_RATE)}
+        df_quote_iv = without_greeks((await iv_store.cached_series(names, start_date, end_date, solve_quotes))[option_ticker], greeks)
+    return df_trade_iv, df_quote_iv
 
-# Eq. OHLCV LF
-def equity_lf(ticker, startDate, endDate, interval): 
-    client = Historical(DATABENTO_API_KEY) 
+# Opt. NBBO HF Underlying + IV
+async def fetch_hf_iv(option_ticker, startDate, endDate, ts_format="str", accept=None, max_points=None, greeks=False, iv_source="trades", cursor=None): 
+    ts_format = validate_ts_format(ts_format)
+    iv_source = (iv_source or "trades").lower()
+    if iv_source not in IV_SOURCES:
+        raise HTTPException(status_code=400, detail="Invalid ivSource. Use 'trades' or 'quotes'.")
+    fmt = negotiate(accept)
+    max_points = validate_max_points(max_points)
     
-    ticker = ticker.upper()
+    # get the underlying 
+    option_ticker, underlying_ticker, expiration_date, strike_price, t = decode_option_ticker(option_ticker)
     
-    start_date, end_date, interval = date_and_interval_validation(startDate, endDate, interval)
+    start_date, end_date, _ = date_and_interval_validation(startDate, endDate, "m", max_intervals=None)
     
-    if len(ticker) > 4: 
-        try:
-            df = client.timeseries.get_range(
-                dataset="OPRA.PILLAR",
-                schema=f"ohlcv-1{interval}",
-                symbols=ticker,
-                start=start_date,
-                end=end_date,
-            ).to_df()
-            
-            # if multiple equal timestamps, find their high and low 
-            # set open to the average of the open 
-            # set close to the average of the close
-            df = df.groupby(df.index).agg({
-                'open': 'mean',
-                'high': 'max',
-                'low': 'min',
-                'close': 'mean',
-                'volume': 'sum'
-            })
-         
-            
-        except Exception as e:
-            print(e)
-            raise HTTPException(status_code=404, detail=f"Bento error.")
+    # pages of 30 minutes, or of a full session when downsampled
+    page = HF_MAX_RANGE if max_points is None else HF_MAX_RANGE_DOWNSAMPLED
+    key = request_key("opt-nbbo-hf", option_ticker, start_date, end_date, max_points, iv_source)
+    start_date, end_date, next_cursor = page_window(start_date, end_date, page, key, cursor)
+
+    # full resolution JSON of a settled page is written series by series, chunk by chunk from
+    # the cache. Arrow, downsampled charts and pages reaching into the unsettled tail (which
+    # every cache read downloads again) are built in one piece
+    settled = pd.Timestamp(end_date) <= pd.Timestamp.now(tz="UTC") - cache.SETTLE_DELAY
+    if max_points is None and fmt != ARROW and settled:
+        response = await stream_hf_iv(option_ticker, underlying_ticker, expiration_date, strike_price, t, start_date, end_date, ts_format, fmt, greeks, iv_source)
+        return with_cursor(response, next_cursor)
+    # the cursor is part of the single-flight key, coalesced callers share the response
+    return await buffered_hf_iv(option_ticker, underlying_ticker, expiration_date, strike_price, t, start_date, end_date, ts_format, fmt, max_points, greeks, iv_source, next_cursor)
+
+@single_flight
+async def buffered_hf_iv(option_ticker, underlying_ticker, expiration_date, strike_price, t, start_date, end_date, ts_format, fmt, max_points, greeks, iv_source, next_cursor=None):
+    with fetch_errors():
+        df_underlying, df_option = await asyncio.gather(
+            asyncio.to_thread(load_mbp, "XNAS.ITCH", "mbp-1", underlying_ticker, start_date, end_date, max_points),
+            asyncio.to_thread(load_mbp, "OPRA.PILLAR", "cmbp-1", option_ticker, start_date, end_date, max_points),
+        )
+
+    async def solve_trades(gap_start, gap_end, symbols):
+        return {option_ticker: await run_cpu(
+            solve_trade_iv, df_underlying, _between(df_option, gap_start, gap_end), expiration_date, strike_price, t)}
+
+    async def solve_quotes(gap_start, gap_end, symbols):
+        return {option_ticker: await run_cpu(
+            solve_quote_iv, _between(df_option, gap_start, gap_end), df_underlying, expiration_date, strike_price, t, greeks=True)}
+
+    df_trade_iv, df_quote_iv = await hf_iv_series(option_ticker, start_date, end_date, greeks, iv_source, solve_trades, solve_quotes)
+
+    response = await run_cpu(
+        build_hf_iv,
+        df_underlying,
+        df_option,
+        option_ticker,
+        underlying_ticker,
+        expiration_date,
+        strike_price,
+        t,
+        ts_format,
+        fmt,
+        max_points,
+        df_trade_iv,
+        df_quote_iv,
+        iv_source,
+    )
+    return with_cursor(response, next_cursor)
+
+def hf_books(option_ticker, underlying_ticker):
+    return {
+        "underlying": ("XNAS.ITCH", "mbp-1", underlying_ticker),
+        "option": ("OPRA.PILLAR", "cmbp-1", option_ticker),
+    }
+
+@single_flight
+async def hf_stream_iv(option_ticker, underlying_ticker, expiration_date, strike_price, t, start_date, end_date, greeks, iv_source):
+    # the shared part of a streamed page: cache downloads and IV solves, only the body is per request
+    books = hf_books(option_ticker, underlying_ticker)
+
+    # fill the cache up front, download errors still get their status code
+    with fetch_errors():
+        await asyncio.gather(*(
+            asyncio.to_thread(cache.prefetch, dataset=dataset, schema=schema, symbols=symbol, start=start_date, end=end_date)
+            for dataset, schema, symbol in books.values()
+        ))
+
+    # the IV solves only load what they use: trades, or the mid changes
+    async def solve_trades(gap_start, gap_end, symbols):
+        df_underlying, df_option = await asyncio.gather(
+            asyncio.to_thread(load_mbp_trades, *books["underlying"], start_date, end_date),
+            asyncio.to_thread(load_mbp_trades, *books["option"], start_date, end_date, gap_start, gap_end),
+        )
+        return {option_ticker: await run_cpu(solve_trade_iv, df_underlying, df_option, expiration_date, strike_price, t)}
+
+    async def solve_quotes(gap_start, gap_end, symbols):
+        underlying_mids, option_mids = await asyncio.gather(
+            asyncio.to_thread(load_mid_changes, *books["underlying"], start_date, end_date, "underlying_mid"),
+            asyncio.to_thread(load_mid_changes, *books["option"], start_date, end_date, "mid", gap_start, gap_end),
+        )
+        return {option_ticker: await run_cpu(solve_mid_iv, option_mids, underlying_mids, expiration_date, strike_price, t, True)}
+
+    return await hf_iv_series(option_ticker, start_date, end_date, greeks, iv_source, solve_trades, solve_quotes)
+
+async def stream_hf_iv(option_ticker, underlying_ticker, expiration_date, strike_price, t, start_date, end_date, ts_format, fmt, greeks, iv_source):
+    books = hf_books(option_ticker, underlying_ticker)
+    df_trade_iv, df_quote_iv = await hf_stream_iv(option_ticker, underlying_ticker, expiration_date, strike_price, t, start_date, end_date, greeks, iv_source)
+    option_trades, option_iv, df_iv = hf_iv_frames(df_trade_iv, df_quote_iv, iv_source)
+    small = {"option_trades": option_trades, "option_iv": option_iv}
+
+    # chart settings come from the option book, seen while it is written
+    prices = {"option_bid": [], "option_ask": []}
+
+    async def encoded(name, column=None):
+        if name in small:
+            if len(small[name]) > 0:
+                yield await asyncio.to_thread(hf_items, small[name], ts_format, column)
+            return
+        dataset, schema, symbol = books[name.split("_")[0]]
+        async for items, (low, high) in thread_iter(hf_encoded_chunks(dataset, schema, symbol, start_date, end_date, name, ts_format, column)):
+            if name in prices:
+                prices[name].append(low if name == "option_bid" else high)
+            yield items
+
+    async def array(items):
+        # one JSON array from the encoded chunks
+        yield b"["
+        first = True
+        async for part in items:
+            if part:
+                yield part if first else b"," + part
+                first = False
+        yield b"]"
+
+    # encoded in a thread of this request, not in the process pool: a pool job could be
+    # rejected (503) after the headers are out. Only one encoded chunk is held at a time,
+    # the columnar format reads a series once per column
+    async def body():
+        for i, name in enumerate(HF_SERIES):
+            yield (b"{" if i == 0 else b",") + json.dumps(name).encode() + b":"
+            if fmt != COLUMNAR:
+                async for part in array(encoded(name)):
+                    yield part
+                continue
+
+            columns = list(small[name].columns) if name in small else HF_COLUMNS
+            for j, column in enumerate(columns):
+                yield (b"{" if j == 0 else b",") + json.dumps(column).encode() + b":"
+                async for part in array(encoded(name, column)):
+                    yield part
+            yield b"}"
+
+        meta = hf_meta(
+            hf_global_data(option_ticker, underlying_ticker, expiration_date, strike_price, iv_source),
+            df_iv,
+            min(prices["option_bid"]) if prices["option_bid"] else None,
+            max(prices["option_ask"]) if prices["option_ask"] else None,
+        )
+        yield b"," + json.dumps(meta, separators=(",", ":"))[1:-1].encode() + b"}"
+
+    return json_stream_response(body(), fmt)
+    
+
+def bar_origin(start_date, unit):
+    # multi-day bins count from the first day (bars stay on their UTC dates), intraday bins
+    # restart every New York day and don't need one
+    return pd.Timestamp(start_date).floor("D") if unit == "d" else None
+
+def bar_start(index, multiple, unit, origin=None):
+    """UTC start of the bin of every timestamp in `index`."""
+    step = pd.Timedelta(seconds=multiple * UNIT_SECONDS[unit])
+    index = pd.DatetimeIndex(index)
+    if unit == "d":
+        origin = pd.Timestamp(0, tz="UTC") if origin is None else pd.Timestamp(origin)
+        return origin + (index - origin) // step * step
+
+    # wall clock time floored within its New York day: bins start at local midnight on
+    # every day (DST changes included) and a day's bars don't depend on the chart's start
+    wall = index.tz_convert(NY_TZ).tz_localize(None)
+    day = wall.normalize()
+    start = day + (wall - day) // step * step
+    # a start in the repeated hour of the fall-back night keeps the offset of its rows
+    is_dst = (wall - index.tz_convert(None)) != _NY_STANDARD_OFFSET
+    return start.tz_localize(NY_TZ, ambiguous=is_dst, nonexistent="shift_forward").tz_convert("UTC")
+
+_NY_STANDARD_OFFSET = pd.Timestamp("2000-01-01", tz=NY_TZ).utcoffset()
+
+def resample_ohlcv(df, multiple, unit, origin=None):
+    # bins only depend on the timestamps, so separate chunks / pages land on one grid
+    bars = df.groupby(bar_start(df.index, multiple, unit, origin)).agg({
+        'open': 'first',
+        'high': 'max',
+        'low': 'min',
+        'close': 'last',
+        'volume': 'sum'
+    })
+    # no trades, no bar (as the native schemas)
+    return bars[bars["open"].notna()]
+
+def ohlcv_base(dataset, ticker, multiple, unit, start_date, end_date):
+    """Native bar size to build the interval from, a window cached at any fitting size is reused."""
+    target = multiple * UNIT_SECONDS[unit]
+    if unit == "d":
+        candidates = ["d"]
     else:
-        try:
-            df = client.timeseries.get_range(
-                dataset="XNAS.ITCH",
-                schema=f"ohlcv-1{interval}",
-                symbols=ticker,
-                start=start_date,
-                end=end_date
-            ).to_df()     
-        except Exception as e:
-            print(e)
-            raise HTTPException(status_code=404, detail=f"Bento error.")
-        
-        
+        candidates = [u for u in ("h", "m", "s") if target % UNIT_SECONDS[u] == 0]
+
+    # the unsettled tail is never cached, only the part before it can be
+    settled_end = min(end_date, (pd.Timestamp.now(tz="UTC") - cache.SETTLE_DELAY).to_pydatetime())
+    window = (end_date - start_date).total_seconds()
+    if settled_end > start_date:
+        for u in candidates:
+            if window / UNIT_SECONDS[u] <= MAX_BASE_BARS and cache.is_cached(dataset, f"ohlcv-1{u}", ticker, start_date, settled_end):
+                return u
+
+    # nothing cached: the coarsest fitting size is the smallest download
+    return candidates[0]
+
+def load_ohlcv(dataset, ticker, base_unit, start_date, end_date, multiple, unit, is_option, origin):
+    # with one origin the bins line up in every chunk, so chunks can be resampled on their
+    # own and only the bars are kept, build_equity merges bars split across chunks
+    pre_resample = not is_option and (multiple, unit) != (1, base_unit)
+
+    frames = []
+    for chunk in cache.iter_range(dataset=dataset, schema=f"ohlcv-1{base_unit}", symbols=ticker, start=start_date, end=end_date, columns=OHLCV_COLUMNS):
+        frames.append(resample_ohlcv(chunk, multiple, unit, origin) if pre_resample else chunk)
+    if not frames:
+        return pd.DataFrame({col: pd.Series(dtype=float) for col in OHLCV_COLUMNS}, index=pd.DatetimeIndex([], tz="UTC"))
+    return pd.concat(frames)
+
+def build_equity(df, interval, ts_format, is_option, base_unit=None, origin=None):
+    multiple, unit = parse_interval(interval)
+    
+    if is_option:
+        # if multiple equal timestamps, find their high and low 
+        # set open to the average of the open 
+        # set close to the average of the close
+        df = df.groupby(df.index).agg({
+            'open': 'mean',
+            'high': 'max',
+            'low': 'min',
+            'close': 'mean',
+            'volume': 'sum'
+        })
+
+    if base_unit is not None and (multiple, unit) != (1, base_unit):
+        df = resample_ohlcv(df, multiple, unit, origin)
+
     # return in form {"open": [...], "high": [...], "low": [...], "close": [...], "volume": [...]}
     chart_data = {
-        "open": [],
-        "high": [],
-        "low": [],
-        "close": [],
-        "volume": [],
-        "x": []
+        "open": format_num(df["open"], ".3f"),
+        "high": format_num(df["high"], ".3f"),
+        "low": format_num(df["low"], ".3f"),
+        "close": format_num(df["close"], ".3f"),
+        "volume": format_num(df["volume"], ".0f"),
+        # daily bars are stamped 00:00 UTC, keep the date as is
+        "x": format_ts(df.index, ts_format, tz=None if unit == "d" else NY_TZ, unit="s"),
     }
     
-    for row in df.itertuples():
-        # get current eastern time date 
-        row_date = row.Index # in UTC
-        row_date = row_date.replace(tzinfo=ZoneInfo("UTC"))
-        
-        # convert to eastern time
-        if interval != "d": # daily will be just 00:00:00, date matches
-            row_date = row_date.astimezone(ZoneInfo("America/New_York"))
-        
-        row_date = row_date.strftime("%Y-%m-%d %H:%M:%S")
-            
-        chart_data["x"].append(row_date)
-        
-        chart_data["open"].append(format(row.open, ".3f"))
-        chart_data["high"].append(format(row.high, ".3f"))
-        chart_data["low"].append(format(row.low, ".3f"))
-        chart_data["close"].append(format(row.close, ".3f"))
-        chart_data["volume"].append(format(row.volume, ".0f"))
-    
     return JSONResponse(content=chart_data)
 
+# Eq. OHLCV LF
+@single_flight
+async def equity_lf(ticker, startDate, endDate, interval, ts_format="str", cursor=None): 
+    ts_format = validate_ts_format(ts_format)
+    
+    ticker = ticker.upper()
+    
+    start_date, end_date, interval = date_and_interval_validation(startDate, endDate, interval, max_intervals=None)
+    
+    # options contracts trade on OPRA, everything else on Nasdaq
+    is_option = len(ticker) > 4
+    dataset = "OPRA.PILLAR" if is_option else "XNAS.ITCH"
+    
+    multiple, unit = parse_interval(interval)
+
+    # pages of MAX_INTERVALS bars, cut on a bar edge so no bar is split between two pages
+    step = pd.Timedelta(seconds=multiple * UNIT_SECONDS[unit])
+    origin = bar_origin(start_date, unit)
+    key = request_key("equity-chart", ticker, start_date, end_date, interval)
+    start_date, end_date, next_cursor = page_window(
+        start_date, end_date, step * MAX_INTERVALS, key, cursor, align=lambda t: bar_start([t], multiple, unit, origin)[0]
+    )
+
+    base_unit = ohlcv_base(dataset, ticker, multiple, unit, start_date, end_date)
+    
+    with fetch_errors(status_code=404, detail="Bento error."):
+        df = await asyncio.to_thread(load_ohlcv, dataset, ticker, base_unit, start_date, end_date, multiple, unit, is_option, origin)
+        
+    response = await run_cpu(build_equity, df, interval, ts_format, is_option, base_unit, origin)
+    return with_cursor(response, next_cursor)
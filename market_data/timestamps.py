@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+
+
+# Column-wise timestamp conversion for the market_data responses.
+# Databento frames carry UTC timestamps, clients get New York wall time strings
+# (the old per-row strftime format) or integer epoch milliseconds.
+
+NY_TZ = "America/New_York"
+
+TS_FORMATS = ("str", "epoch")
+
+
+def validate_ts_format(ts_format):
+    ts_format = (ts_format or "str").lower()
+    if ts_format not in TS_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid tsFormat. Use 'str' or 'epoch'.")
+    return ts_format
+
+
+def _utc_index(ts):
+    ts = pd.DatetimeIndex(ts)
+    if ts.tz is None:
+        return ts.tz_localize("UTC")
+    return ts
+
+
+def format_ts(ts, ts_format="str", tz=NY_TZ, unit="us"):
+    """
+    Convert a whole column of timestamps in one pass.
+
+    ts_format="str"   -> "YYYY-MM-DD HH:MM:SS.ffffff" in `tz` (unit="s" drops the fraction,
+                         tz=None keeps UTC, e.g. for daily bars)
+    ts_format="epoch" -> int milliseconds since the unix epoch (always UTC)
+    """
+    ts = _utc_index(ts)
+    if len(ts) == 0:
+        return []
+
+    if ts_format == "epoch":
+        return (ts.as_unit("ns").asi8 // 1_000_000).tolist()
+
+    if tz is not None:
+        ts = ts.tz_convert(tz)
+
+    # local wall time as naive datetime64, formatted by NumPy in C
+    wall = ts.tz_localize(None).values.astype(f"datetime64[{unit}]")
+    return np.char.replace(np.datetime_as_string(wall, unit=unit), "T", " ").tolist()
+
+
+def format_num(values, spec):
+    # e.g. spec=".3f", keeps the string output of format(x, spec)
+    return np.char.mod(f"%{spec}", np.asarray(values, dtype=float)).tolist()
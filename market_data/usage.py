@@ -0,0 +1,74 @@
+import os
+import threading
+from collections import defaultdict
+from contextvars import ContextVar
+
+from fastapi import HTTPException
+
+
+# Databento usage per endpoint and schema.
+#
+# Every get_range (market_data.client) adds its wall time, the bytes received and the
+# pre-flight cost estimate, the decoders (market_data.cache) add the records. The endpoint
+# is whatever the caller put into `endpoint` (the request path, "warmer", ...), it follows
+# the request into to_thread workers.
+#
+# Pre-flight: before a download the metadata API prices the request, above
+# MARKET_MAX_REQUEST_COST dollars (default 5, 0 = no check) it is rejected with 400
+# instead of being downloaded.
+
+MAX_REQUEST_COST = float(os.getenv("MARKET_MAX_REQUEST_COST", "5"))
+
+endpoint = ContextVar("market_endpoint", default="other")
+
+_lock = threading.Lock()
+_counters = defaultdict(lambda: {"calls": 0, "errors": 0, "rejected": 0, "records": 0, "bytes": 0, "cost": 0.0, "seconds": 0.0})
+
+
+def _key(dataset, schema):
+    return endpoint.get(), str(dataset), str(schema)
+
+
+class CostLimitExceeded(HTTPException):
+    """A download priced above MARKET_MAX_REQUEST_COST, answered with 400."""
+
+    def __init__(self, schema, cost):
+        super().__init__(
+            status_code=400,
+            detail=f"Request too large: estimated ${cost:.2f} of {schema} data (limit ${MAX_REQUEST_COST:.2f}). Narrow the range.",
+        )
+
+
+def check_cost(dataset, schema, cost):
+    """Raise CostLimitExceeded if the estimated cost of one download is above the limit."""
+    if MAX_REQUEST_COST > 0 and cost > MAX_REQUEST_COST:
+        with _lock:
+            _counters[_key(dataset, schema)]["rejected"] += 1
+        raise CostLimitExceeded(schema, cost)
+
+
+def record_call(dataset, schema, seconds, nbytes=0, cost=0.0, error=False):
+    with _lock:
+        counters = _counters[_key(dataset, schema)]
+        counters["calls"] += 1
+        counters["errors"] += int(error)
+        counters["seconds"] += seconds
+        counters["bytes"] += nbytes
+        counters["cost"] += cost
+
+
+def record_records(dataset, schema, records):
+    with _lock:
+        _counters[_key(dataset, schema)]["records"] += records
+
+
+def metrics():
+    """{endpoint: {"dataset/schema": counters}}"""
+    out = defaultdict(dict)
+    with _lock:
+        for (name, dataset, schema), counters in sorted(_counters.items()):
+            out[name][f"{dataset}/{schema}"] = {
+                **counters,
+                "avg_seconds": counters["seconds"] / counters["calls"] if counters["calls"] else 0.0,
+            }
+    return dict(out)
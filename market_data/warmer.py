@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+import traceback
+from functools import lru_cache
+from datetime import date, datetime, time as dt_time, timedelta
+
+import pandas as pd
+from databento import SType
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar, GoodFriday, Holiday, USLaborDay, USMartinLutherKingJr, USMemorialDay, USPresidentsDay,
+    USThanksgivingDay, nearest_workday, sunday_to_monday,
+)
+
+from market_data import cache, usage
+from market_data.chain_index import decode_chain, underlying_close
+from market_data.timestamps import NY_TZ
+
+
+# Cache warming for a watchlist, runs as a thread next to the news fetch loop (main.py).
+#
+# Before the open (from WARM_START, New York time) of every trading day, once:
+#   - daily / hourly / minute bars up to the previous session
+#   - the option definitions of the previous session
+#   - the previous session's NBBO of the underlying (mbp-1) and of the front-month
+#     contracts closest to the money (cmbp-1)
+# During the session, every MARKET_WARM_INTERVAL_MINUTES: today's minute bars,
+# definitions and NBBO so far. Only settled data is downloaded (see cache.prefetch),
+# every pass only fetches what is new since the last one.
+#
+# Every Databento request counts against MARKET_WARM_MAX_REQUESTS per day, once it is
+# spent the warmer waits for the next day. The interactive endpoints are not limited.
+#
+#   MARKET_WARM_WATCHLIST          comma separated tickers, empty = no warming (default)
+#   MARKET_WARM_INTERVAL_MINUTES   minutes between the intraday passes (default 15)
+#   MARKET_WARM_MAX_REQUESTS       Databento requests per day (default 300)
+#   MARKET_WARM_CONTRACTS          front-month contracts per ticker (default 10)
+#   MARKET_WARM_HOLIDAYS           extra closures (beyond the NYSE holiday rules), comma separated YYYY-MM-DD
+
+WATCHLIST = [t.strip().upper() for t in os.getenv("MARKET_WARM_WATCHLIST", "").split(",") if t.strip()]
+INTERVAL = timedelta(minutes=int(os.getenv("MARKET_WARM_INTERVAL_MINUTES", "15")))
+MAX_REQUESTS = int(os.getenv("MARKET_WARM_MAX_REQUESTS", "300"))
+CONTRACTS = int(os.getenv("MARKET_WARM_CONTRACTS", "10"))
+
+WARM_START = dt_time(7, 0)
+SESSION_START = dt_time(4, 0)   # XNAS extended hours
+MARKET_OPEN = dt_time(9, 30)
+SESSION_END = dt_time(20, 0)
+
+# bar schema -> how far back it is kept warm, bar length
+BARS = {
+    "ohlcv-1d": (timedelta(days=365), "D"),
+    "ohlcv-1h": (timedelta(days=30), "h"),
+    "ohlcv-1m": (timedelta(days=5), "min"),
+}
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """NYSE full-day closures by their rules, Saturday holidays are observed on Friday
+    except New Year's Day."""
+
+    rules = [
+        Holiday("New Year's Day", month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday("Juneteenth", month=6, day=19, start_date="2022-01-01", observance=nearest_workday),
+        Holiday("Independence Day", month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday("Christmas Day", month=12, day=25, observance=nearest_workday),
+    ]
+
+
+# one-off closures (national days of mourning, ...) are not in the rules
+SPECIAL_CLOSURES = {
+    date(2025, 1, 9),
+    *(date.fromisoformat(d.strip()) for d in os.getenv("MARKET_WARM_HOLIDAYS", "").split(",") if d.strip()),
+}
+
+_calendar = NYSEHolidayCalendar()
+
+
+@lru_cache(maxsize=16)
+def holidays(year):
+    return {ts.date() for ts in _calendar.holidays(date(year, 1, 1), date(year, 12, 31))} | SPECIAL_CLOSURES
+
+
+POLL_SECONDS = 30
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def previous_trading_day(day):
+    day -= timedelta(days=1)
+    while not is_trading_day(day):
+        day -= timedelta(days=1)
+    return day
+
+
+def _ny(day, at):
+    return pd.Timestamp(datetime.combine(day, at), tz=NY_TZ)
+
+
+class Budget:
+    """Databento requests the warmer may still make today."""
+
+    def __init__(self, max_requests):
+        self.max_requests = max_requests
+        self.day = None
+        self.used = 0
+
+    def reset(self, day):
+        if day != self.day:
+            self.day = day
+            self.used = 0
+
+    def exhausted(self):
+        return self.used >= self.max_requests
+
+    def spend(self, requests):
+        self.used += requests
+
+
+class Warmer:
+    def __init__(self, watchlist=None, max_requests=None):
+        self.watchlist = WATCHLIST if watchlist is None else watchlist
+        self.budget = Budget(MAX_REQUESTS if max_requests is None else max_requests)
+        self.premarket_done = None
+        self.next_intraday = None
+
+    def _prefetch(self, **kwargs):
+        if self.budget.exhausted():
+            return False
+        try:
+            self.budget.spend(cache.prefetch(**kwargs))
+        except usage.CostLimitExceeded as e:
+            # the rest of the pass still runs
+            print(f"Market cache warming skipped {kwargs['schema']} {kwargs['symbols']}: {e.detail}")
+            return False
+        return True
+
+    def front_month(self, ticker, day, settled):
+        """The CONTRACTS front-month contracts of `day` closest to the last close."""
+        day_start = pd.Timestamp(day, tz="UTC")
+        end = min(settled, day_start + timedelta(days=1))
+        # the daily bar of a running day is not there yet
+        close_day = day if day_start + timedelta(days=1) <= settled else previous_trading_day(day)
+
+        self._prefetch(dataset="OPRA.PILLAR", schema="definition", symbols=f"{ticker}.OPT", stype_in=SType.PARENT,
+                       start=day_start, end=end)
+        self._prefetch(dataset="XNAS.ITCH", schema="ohlcv-1d", symbols=ticker,
+                       start=pd.Timestamp(close_day) - timedelta(days=7), end=pd.Timestamp(close_day) + timedelta(days=1))
+        if self.budget.exhausted() or end <= day_start:
+            return []
+
+        # both ranges are on disk now, these only read the cache
+        defs = cache.get_range(dataset="OPRA.PILLAR", schema="definition", symbols=f"{ticker}.OPT", stype_in=SType.PARENT,
+                               start=day_start, end=end, columns=["raw_symbol"])
+        close = underlying_close(ticker, pd.Timestamp(close_day))
+        if defs.empty or close is None:
+            return []
+
+        chain = decode_chain(defs["raw_symbol"])
+        chain = chain[chain["expiration"] >= day.strftime("%Y-%m-%d")]
+        if chain.empty:
+            return []
+        chain = chain[chain["expiration"] == chain["expiration"].iloc[0]]
+        nearest = (chain["strike_price"] - close).abs().sort_values(kind="stable").index[:CONTRACTS]
+        return chain.loc[nearest, "raw_symbol"].tolist()
+
+    def warm_session(self, ticker, day, end=None):
+        """Bars, definitions and NBBO of `ticker` for the session of `day` up to `end`."""
+        session_start = _ny(day, SESSION_START)
+        session_end = _ny(day, SESSION_END) if end is None else min(end, _ny(day, SESSION_END))
+        settled = min(session_end, pd.Timestamp.now(tz=NY_TZ) - cache.SETTLE_DELAY).tz_convert("UTC")
+
+        for schema, (lookback, bar) in BARS.items():
+            # complete bars only, a bar still being built would be cached as missing
+            self._prefetch(dataset="XNAS.ITCH", schema=schema, symbols=ticker,
+                           start=pd.Timestamp(day, tz="UTC") - lookback, end=settled.floor(bar))
+
+        contracts = self.front_month(ticker, day, settled)
+        self._prefetch(dataset="XNAS.ITCH", schema="mbp-1", symbols=ticker, start=session_start, end=session_end)
+        if contracts:
+            self._prefetch(dataset="OPRA.PILLAR", schema="cmbp-1", symbols=contracts, start=session_start, end=session_end)
+
+    def run_once(self, now=None):
+        """One scheduling step, returns the tickers warmed."""
+        now = pd.Timestamp.now(tz=NY_TZ) if now is None else now.tz_convert(NY_TZ)
+        today = now.date()
+        self.budget.reset(today)
+        if not self.watchlist or not is_trading_day(today) or self.budget.exhausted():
+            return []
+
+        warmed = []
+        if self.premarket_done != today and now.time() >= WARM_START:
+            for ticker in self.watchlist:
+                self.warm_session(ticker, previous_trading_day(today))
+                warmed.append(ticker)
+            self.premarket_done = today
+            self.next_intraday = max(now, _ny(today, MARKET_OPEN))
+            return warmed
+
+        if self.next_intraday is not None and MARKET_OPEN <= now.time() < SESSION_END and now >= self.next_intraday:
+            for ticker in self.watchlist:
+                self.warm_session(ticker, today, end=now)
+                warmed.append(ticker)
+            self.next_intraday = now + INTERVAL
+        return warmed
+
+    def run_forever(self):
+        usage.endpoint.set("warmer")
+        while True:
+            try:
+                warmed = self.run_once()
+                if warmed:
+                    print(f"Market cache warmed for {', '.join(warmed)} ({self.budget.used}/{self.budget.max_requests} requests today)")
+            except Exception as e:
+                print(f"Error warming market cache: {e}")
+                traceback.print_exc()
+            time.sleep(POLL_SECONDS)
+
+
+def start_warmer():
+    """Start the warmer thread if a watchlist is configured, returns the thread or None."""
+    if not WATCHLIST:
+        return None
+    thread = threading.Thread(target=Warmer().run_forever, name="market-warmer", daemon=True)
+    thread.start()
+    return thread
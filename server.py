@@ -1,11 +1,12 @@
 # start via `uvicorn server:app --reload`
 
-from fastapi import FastAPI, Query, HTTPException, Request, status
+from fastapi import FastAPI, Query, HTTPException, Request, status, Header, WebSocket
 from pydantic import BaseModel, Field
 from fastapi.middleware.gzip import GZipMiddleware
-from typing import List, Optional
+from typing import List, Optional, Union
 from datetime import datetime
 from fastapi.responses import JSONResponse
+import asyncio
 import pandas as pd
 from databento import Historical, SType
 from fastapi.middleware.cors import CORSMiddleware
@@ -22,7 +23,10 @@ from fastapi import Response
 
 from news_data import ArticleSearch, Shared
 
-from market_data import fetch_multi_iv, equity_lf, fetch_hf_iv, option_solver, get_option_definitions, decode_option_ticker
+from market_data import fetch_multi_iv, equity_lf, fetch_hf_iv, option_solver, option_solver_batch, get_option_definitions, decode_option_ticker, fetch_iv_surface, fetch_strategy, fetch_chain_activity
+from market_data.executor import run_cpu
+from market_data import executor as market_executor, singleflight, live, usage
+from market_data.timestamps import validate_ts_format
 from kk import KK_data
 from starlette.middleware.base import BaseHTTPMiddleware
 import psycopg2
@@ -43,6 +47,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # continuation token of paged market data responses
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Session middleware
@@ -104,6 +110,14 @@ class SessionMiddleware(BaseHTTPMiddleware):
 
 app.add_middleware(SessionMiddleware)
 
+# Databento usage (market_data.usage) is counted per request path
+class MarketUsageMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        usage.endpoint.set(request.url.path)
+        return await call_next(request)
+
+app.add_middleware(MarketUsageMiddleware)
+
 app.add_middleware(GZipMiddleware, minimum_size=500)
 
 @app.post("/create-session")
@@ -138,8 +152,55 @@ def test():
     return {"test": "connection"}
 
 @app.get("/option-definitions")
-def get_option_definitions_handler(start_date: str, ticker: str):
-    return get_option_definitions(start_date=start_date, ticker=ticker)
+async def get_option_definitions_handler(
+    start_date: str,
+    ticker: str,
+    expiration: Optional[str] = None, # YYYY-MM-DD
+    min_strike: Optional[float] = None,
+    max_strike: Optional[float] = None,
+    type: Optional[str] = None, # C or P
+    min_moneyness: Optional[float] = None, # strike / underlying price
+    max_moneyness: Optional[float] = None,
+    underlying_price: Optional[float] = None, # default: last close of the underlying
+    page: Optional[int] = None, # 500 contracts per page, all if not set
+):
+    return await get_option_definitions(
+        start_date=start_date,
+        ticker=ticker,
+        expiration=expiration,
+        min_strike=min_strike,
+        max_strike=max_strike,
+        instrument_class=type,
+        min_moneyness=min_moneyness,
+        max_moneyness=max_moneyness,
+        underlying_price=underlying_price,
+        page=page,
+    )
+
+# most active contracts of a chain, one parent-symbol request
+@app.get("/chain-activity")
+async def chain_activity(
+    ticker: str,
+    date: Optional[str] = None, # YYYY-MM-DD, default today (New York)
+    source: str = "ohlcv", # ohlcv (bars, estimated premium) or trades (exact premium, trade count, VWAP)
+    metric: str = "volume", # volume, premium or trades (source=trades only)
+    top: int = 25, # up to 500
+    expiration: Optional[str] = None, # YYYY-MM-DD
+    type: Optional[str] = None, # C or P
+    min_strike: Optional[float] = None,
+    max_strike: Optional[float] = None,
+):
+    return await fetch_chain_activity(
+        ticker=ticker,
+        day=date,
+        source=source,
+        metric=metric,
+        top=top,
+        expiration=expiration,
+        instrument_class=type,
+        min_strike=min_strike,
+        max_strike=max_strike,
+    )
 
 
 class OptionPriceRequest(BaseModel):
@@ -167,33 +228,173 @@ def option_solver_handler(request: OptionPriceRequest):
         timeUnits=request.timeUnits
     )
 
+class SolverRange(BaseModel):
+    start: float
+    stop: float
+    num: int
+
+SolverInput = Union[float, List[float], SolverRange]
+
+class OptionSolverBatchRequest(BaseModel):
+    r: SolverInput = 0.0 # interest rate
+    vol: SolverInput = 0.0 # volatility
+    s: SolverInput = 0.0 # strike
+    t: SolverInput = 0.0 # time to expiration
+    type: str # call or put
+    u: SolverInput = 0.0 # underlying
+    price: SolverInput = 0.0 # option price
+    solveFor: str # vol, price, t, s, r, u
+    timeUnits: str # y, d, h (units of t)
+    grid: Optional[List[str]] = None # e.g. ["u", "t"]: result matrix over these inputs, otherwise lists are solved element-wise
+
+@app.post("/option-solver/batch")
+async def option_solver_batch_handler(request: OptionSolverBatchRequest):
+    def plain(value):
+        return value.model_dump() if isinstance(value, SolverRange) else value
+
+    return await run_cpu(
+        option_solver_batch,
+        r=plain(request.r),
+        vol=plain(request.vol),
+        s=plain(request.s),
+        t=plain(request.t),
+        type=request.type,
+        u=plain(request.u),
+        price=plain(request.price),
+        solveFor=request.solveFor,
+        timeUnits=request.timeUnits,
+        grid=request.grid,
+    )
+
 class EquityChartRequest(BaseModel):
     ticker: str # >4 chars for options contracts
     startDate: str # YYYY-MM-DD HH:MM:SS or YYYY-MM-DD
     endDate: str # YYYY-MM-DD HH:MM:SS or YYYY-MM-DD
-    interval: str # D, H, M, S
+    interval: str # D, H, M, S or a multiple such as 5M, 15M, 4H (resampled from cached bars)
+    tsFormat: str = "str" # str (New York time) or epoch (ms, UTC)
+    maxPoints: Optional[int] = None # /opt-nbbo-hf: downsample every series to about this many points (10 to 10,000)
+    greeks: bool = False # /opt-nbbo-hf: add delta, gamma, vega, theta to the IV series
+    ivSource: str = "trades" # /opt-nbbo-hf: IV series from option trades, or "quotes" (every NBBO mid change vs the underlying mid)
+    cursor: Optional[str] = None # X-Next-Cursor of the previous page, ranges over 10,000 bars / 30 minutes (16h with maxPoints) are paged
     
 @app.post("/equity-chart")
-def equity_chart(request: EquityChartRequest):
-    return equity_lf(
+async def equity_chart(request: EquityChartRequest):
+    return await equity_lf(
         ticker=request.ticker,
         startDate=request.startDate,
         endDate=request.endDate,
-        interval=request.interval
+        interval=request.interval,
+        ts_format=request.tsFormat,
+        cursor=request.cursor,
     )
 
+# Accept: application/json (default), application/vnd.rflx.columnar+json or application/vnd.apache.arrow.stream
 @app.post("/opt-nbbo-hf")
-def opt_nbbo_hf(request: EquityChartRequest):
-    return fetch_hf_iv(request.ticker, request.startDate, request.endDate)
+async def opt_nbbo_hf(request: EquityChartRequest, accept: Optional[str] = Header(None)):
+    return await fetch_hf_iv(request.ticker, request.startDate, request.endDate, ts_format=request.tsFormat, accept=accept, max_points=request.maxPoints, greeks=request.greeks, iv_source=request.ivSource, cursor=request.cursor)
 
 class MultiIVRequest(BaseModel):
     contracts: List[str] # list of option tickers
     startDate: str # YYYY-MM-DD HH:MM:SS or YYYY-MM-DD
     endDate: str # YYYY-MM-DD HH:MM:SS or YYYY-MM-DD
+    tsFormat: str = "str" # str (New York time) or epoch (ms, UTC)
+    greeks: bool = False # add delta, gamma, vega, theta to every contract
+    cursor: Optional[str] = None # X-Next-Cursor of the previous page, ranges over 5 days are paged
 
+# Accept: as /opt-nbbo-hf, or application/x-ndjson to stream the underlying and then every contract as it is solved
 @app.post("/multi-iv")
-def multi_iv(request: MultiIVRequest):
-    return fetch_multi_iv(raw_opt_tickers=request.contracts, start_date=request.startDate, end_date=request.endDate)
+async def multi_iv(request: MultiIVRequest, accept: Optional[str] = Header(None)):
+    return await fetch_multi_iv(raw_opt_tickers=request.contracts, start_date=request.startDate, end_date=request.endDate, ts_format=request.tsFormat, accept=accept, greeks=request.greeks, cursor=request.cursor)
+
+class StrategyLeg(BaseModel):
+    contract: str # option ticker
+    quantity: int # contracts, negative = short
+
+class StrategyRequest(BaseModel):
+    legs: List[StrategyLeg] # up to 8, same underlying
+    startDate: str # YYYY-MM-DD HH:MM (New York time)
+    endDate: str # YYYY-MM-DD HH:MM (New York time)
+    tsFormat: str = "str" # str (New York time) or epoch (ms, UTC)
+    greeks: bool = False # add delta, gamma, vega, theta to every leg series (the strategy series always has the net greeks)
+    cursor: Optional[str] = None # X-Next-Cursor of the previous page, ranges over 5 days are paged
+
+# net premium and net greeks on the common timeline of the legs, plus every leg as in /multi-iv
+# Accept: application/json (default), application/vnd.rflx.columnar+json or application/vnd.apache.arrow.stream
+@app.post("/strategy")
+async def strategy(request: StrategyRequest, accept: Optional[str] = Header(None)):
+    return await fetch_strategy(
+        legs=[(leg.contract, leg.quantity) for leg in request.legs],
+        start_date=request.startDate,
+        end_date=request.endDate,
+        ts_format=request.tsFormat,
+        accept=accept,
+        greeks=request.greeks,
+        cursor=request.cursor,
+    )
+
+class IVSurfaceRequest(BaseModel):
+    ticker: str # underlying
+    timestamp: str # YYYY-MM-DD HH:MM (New York time), end of the quote window
+    windowSeconds: int = 60 # last quote of every contract within this window
+    type: str = "otm" # otm (puts below, calls above the underlying), C or P
+    minMoneyness: Optional[float] = None # strike / underlying price
+    maxMoneyness: Optional[float] = None
+    minExpiration: Optional[str] = None # YYYY-MM-DD
+    maxExpiration: Optional[str] = None # YYYY-MM-DD
+
+@app.post("/iv-surface")
+async def iv_surface(request: IVSurfaceRequest):
+    return await fetch_iv_surface(
+        ticker=request.ticker,
+        timestamp=request.timestamp,
+        window_seconds=request.windowSeconds,
+        surface_type=request.type,
+        min_moneyness=request.minMoneyness,
+        max_moneyness=request.maxMoneyness,
+        min_expiration=request.minExpiration,
+        max_expiration=request.maxExpiration,
+    )
+
+# process pool queue depth and timings, coalesced requests of the market endpoints
+@app.get("/market-metrics")
+def market_metrics():
+    return {**market_executor.metrics(), "single_flight": singleflight.metrics(), "databento": usage.metrics()}
+
+
+def validate_session_token(token: str):
+    # same lookup as SessionMiddleware, which only sees http requests
+    db = psycopg2.connect(
+        dbname="postgres",
+        user="admin",
+        password="secret",
+        host="localhost",
+        port=5432
+    )
+    cursor = db.cursor()
+    cursor.execute("SELECT id FROM sessions WHERE token = %s AND expires_at > NOW()", (token,))
+    result = cursor.fetchone()
+    cursor.close()
+    db.close()
+    return result is not None
+
+# live NBBO + IV deltas of one option, token as query param (browsers can't set headers) or session cookie
+@app.websocket("/ws/opt-nbbo")
+async def opt_nbbo_ws(websocket: WebSocket, ticker: str, tsFormat: str = "str", token: Optional[str] = None):
+    token = token or websocket.cookies.get("session")
+    # a new connection and a blocking query, kept off the event loop like the live upstreams
+    if not token or not await asyncio.to_thread(validate_session_token, token):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid session")
+        return
+
+    try:
+        ts_format = validate_ts_format(tsFormat)
+        decode_option_ticker(ticker)
+    except (HTTPException, ValueError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid tsFormat or ticker")
+        return
+
+    await websocket.accept()
+    await live.serve(websocket, ticker, ts_format)
 
 
 # expressions